@@ -0,0 +1,186 @@
+import json
+import random
+import re
+import threading
+import time
+
+
+class TranslatorBackend:
+    """
+    Interface of the translation providers used by the translators
+    @attr name : name used to select the backend from the command line
+    @attr max_chars : maximum number of characters accepted in a single request
+    @attr max_batch : maximum number of sentences translated by a single translate_batch request
+    """
+    name = None
+    max_chars = 5000
+    max_batch = 1
+
+    def translate(self, text, src, dest):
+        """
+        @return : the translation of text as a string
+        """
+        raise NotImplementedError
+
+    def translate_batch(self, texts, src, dest):
+        """
+        @return : the list of translations of texts, in the same order
+        """
+        return [self.translate(text, src, dest) for text in texts]
+
+    def close(self):
+        pass
+
+
+class UnreadableResponse(ConnectionError):
+    """
+    The provider answered with a body that is not a translation, as Google does when it throttles the requests
+    """
+
+
+class GoogleBackend(TranslatorBackend):
+    """
+    Google Translate through googletrans. Each thread keeps its own long-lived client, so connections are reused
+    by all the files translated in the same run.
+    """
+    name = 'google'
+    max_chars = 5000
+    max_batch = 1
+
+    def __init__(self, **kwargs):
+        from googletrans import Translator  # pip install googletrans==4.0.0rc1
+        self._translator_class = Translator
+        self._local = threading.local()
+        self._clients = []
+        self._lock = threading.Lock()
+
+    def _client(self):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._translator_class()
+            # googletrans 4.0.0rc1 looks up this misspelled attribute to raise the HTTP status of a rejected request,
+            # without it a 429 fails with an AttributeError
+            client.raise_Exception = True
+            self._local.client = client
+            with self._lock:
+                self._clients.append(client)
+        return client
+
+    def translate(self, text, src, dest):
+        try:
+            return self._client().translate(text, src=src, dest=dest).text
+        except (AttributeError, TypeError, ValueError) as e:
+            # googletrans fails on the body it could not parse (ex: JSONDecodeError) instead of reporting it
+            raise UnreadableResponse('unreadable response from Google Translate: {!r}'.format(e)) from e
+
+    def close(self):
+        with self._lock:
+            for client in self._clients:
+                if hasattr(getattr(client, 'client', None), 'close'):
+                    client.client.close()
+            self._clients = []
+
+
+class OfflineBackend(TranslatorBackend):
+    """
+    Translator that never touches the network, used to test and benchmark the translators
+    @param mode : 'identity' returns the text unchanged, 'reverse' reverses each word except placeholders,
+                  'dict' looks the text up in dict_path and returns it unchanged when missing
+    @param dict_path : JSON file mapping each sentence to its translation, used by the 'dict' mode
+    @param latency : seconds waited by each request
+    @param failure_rate : probability of a request failing with a ConnectionError
+    @param seed : seed of the failures, for reproducible runs
+    @param max_batch : sentences translated by a single translate_batch request, 1 to receive the packs joined by
+                       the delimiter like Google Translate does
+    """
+    name = 'offline'
+    max_chars = 5000
+    max_batch = 100
+
+    def __init__(self, mode='identity', dict_path=None, latency=0.0, failure_rate=0.0, seed=None, max_batch=100,
+                 **kwargs):
+        if mode not in ('identity', 'reverse', 'dict'):
+            raise ValueError('unknown offline mode: {}'.format(mode))
+        if mode == 'dict' and not dict_path:
+            raise ValueError('the offline dict mode needs the path of a JSON dictionary (--offline_dict)')
+        self.mode = mode
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.max_batch = max_batch
+        self.requests = 0
+        self.failures = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.dictionary = {}
+        if mode == 'dict':
+            with open(dict_path, 'r', encoding='utf-8') as f:
+                self.dictionary = json.load(f)
+
+    def _translate(self, text):
+        if self.mode == 'reverse':
+            # placeholders ({0}, {1}, ...) are kept like a real translator does
+            return re.sub(r'(\{\d+\})|[^\s{]+|\{', lambda m: m.group(1) or m.group()[::-1], text)
+        if self.mode == 'dict':
+            return self.dictionary.get(text, text)
+        return text
+
+    def _request(self):
+        with self._lock:
+            self.requests += 1
+            failed = self._random.random() < self.failure_rate
+            if failed:
+                self.failures += 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+        if failed:
+            raise ConnectionError('offline backend: simulated failure')
+
+    def translate(self, text, src, dest):
+        self._request()
+        return self._translate(text)
+
+    def translate_batch(self, texts, src, dest):
+        self._request()
+        return [self._translate(text) for text in texts]
+
+
+class _TranslatorAdapter(TranslatorBackend):
+    """
+    Wraps any object providing translate(text, src=src, dest=dest).text (ex: googletrans.Translator)
+    """
+    name = 'adapter'
+
+    def __init__(self, tr):
+        self.tr = tr
+
+    def translate(self, text, src, dest):
+        return self.tr.translate(text, src=src, dest=dest).text
+
+
+BACKENDS = {backend.name: backend for backend in (GoogleBackend, OfflineBackend)}
+
+
+def get_backend(name, **kwargs):
+    if name not in BACKENDS:
+        raise ValueError('unknown backend {}, available: {}'.format(name, ', '.join(BACKENDS)))
+    return BACKENDS[name](**kwargs)
+
+
+def as_backend(tr):
+    if isinstance(tr, TranslatorBackend):
+        return tr
+    return _TranslatorAdapter(tr)
+
+
+def add_backend_arguments(ap):
+    ap.add_argument("-b", "--backend", type=str, default="google", choices=sorted(BACKENDS))
+    ap.add_argument("-om", "--offline_mode", type=str, default="identity", choices=["identity", "reverse", "dict"])
+    ap.add_argument("-od", "--offline_dict", type=str, default=None)
+    ap.add_argument("-ol", "--offline_latency", type=float, default=0.0)
+    ap.add_argument("-of", "--offline_failure_rate", type=float, default=0.0)
+    ap.add_argument("-omb", "--offline_max_batch", type=int, default=100)
+
+
+def backend_from_args(args):
+    return get_backend(args.backend, mode=args.offline_mode, dict_path=args.offline_dict, latency=args.offline_latency,
+                       failure_rate=args.offline_failure_rate, max_batch=args.offline_max_batch)
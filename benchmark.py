@@ -0,0 +1,253 @@
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import dialogs_translator
+import objects_translator
+from backends import OfflineBackend
+from translation_engine import TranslationEngine
+
+WORDS = ("il la un una che non per con come questo quella sono era ho hai abbiamo tempo mare cielo isola giungla "
+         "spada scudo pozione villaggio castello principessa re regina drago mostro foresta grotta tesoro chiave "
+         "porta strada viaggio amico nemico guerra pace magia fuoco ghiaccio vento terra luce ombra notte giorno "
+         "sì no forse grazie aiuto presto dove quando perché").split()
+NAMES = ['Destiny', 'Nashira', 'Gaya', 'Orion', 'Lyra']
+PATHS = ['translate', 'translate_neatly', 'translate_neatly_common_events', 'objects_translator']
+CONTROL_CODES = ['\\N[1]', '\\N[2]', '\\V[12]', '\\C[2]', '\\I[45]', '\\!', '\\.']
+
+
+class _Generator:
+    """
+    Generates random sentences, reusing previous ones with probability repeat like real games do
+    """
+
+    def __init__(self, seed, repeat):
+        self.random = random.Random(seed)
+        self.repeat = repeat
+        self.sentences = []
+
+    def sentence(self, min_words=3, max_words=14):
+        if self.sentences and self.random.random() < self.repeat:
+            return self.random.choice(self.sentences)
+        words = [self.random.choice(WORDS) for _ in range(self.random.randint(min_words, max_words))]
+        if self.random.random() < 0.2:
+            words.insert(self.random.randrange(len(words)), self.random.choice(CONTROL_CODES))
+        if self.random.random() < 0.2:
+            words.insert(self.random.randrange(len(words)), self.random.choice(NAMES))
+        sentence = ' '.join(words)
+        sentence = sentence[0].upper() + sentence[1:] + self.random.choice(['.', '!', '?', '...'])
+        self.sentences.append(sentence)
+        return sentence
+
+    def dialog(self, indent=0):
+        commands = [{"code": 101, "indent": indent, "parameters": ["Actor1", 0, 0, 2]}]
+        for _ in range(self.random.randint(1, 4)):
+            commands.append({"code": 401, "indent": indent, "parameters": [self.sentence(2, 8)]})
+        return commands
+
+    def choices(self, indent=0):
+        choices = [self.sentence(1, 3) for _ in range(self.random.randint(2, 4))]
+        commands = [{"code": 102, "indent": indent, "parameters": [choices, 1, 0, 2, 0]}]
+        for i, choice in enumerate(choices):
+            commands.append({"code": 402, "indent": indent, "parameters": [i, choice]})
+            commands.extend(self.dialog(indent + 1))
+            commands.append({"code": 0, "indent": indent + 1, "parameters": []})
+        commands.append({"code": 404, "indent": indent, "parameters": []})
+        return commands
+
+    def scrolling_text(self, indent=0):
+        commands = [{"code": 105, "indent": indent, "parameters": [2, False]}]
+        for _ in range(self.random.randint(2, 6)):
+            commands.append({"code": 405, "indent": indent, "parameters": [self.sentence(4, 10)]})
+        return commands
+
+    def command_list(self, size):
+        commands = []
+        while len(commands) < size:
+            r = self.random.random()
+            if r < 0.55:
+                commands.extend(self.dialog())
+            elif r < 0.7:
+                commands.extend(self.choices())
+            elif r < 0.75:
+                commands.extend(self.scrolling_text())
+            elif r < 0.85:
+                commands.append({"code": 356, "indent": 0, "parameters": ["ShowQuestLog"]})
+            else:
+                commands.append({"code": 121, "indent": 0, "parameters": [1, 1, 0]})
+        commands.append({"code": 0, "indent": 0, "parameters": []})
+        return commands
+
+
+def generate_project(folder, maps=10, events=50, pages=2, commands=30, common_events=100, objects=200, repeat=0.3,
+                     seed=0):
+    """
+    Write a synthetic RPG Maker MV project in folder/dialogs and folder/objects
+    @param maps : number of MapXXX.json files
+    @param events : number of events in each map
+    @param pages : number of pages of each event
+    @param commands : approximate number of commands in each page
+    @param common_events : number of common events
+    @param objects : number of records in each object database
+    @param repeat : probability of reusing an already generated sentence
+    """
+    gen = _Generator(seed, repeat)
+    dialogs_folder = os.path.join(folder, 'dialogs')
+    objects_folder = os.path.join(folder, 'objects')
+    os.makedirs(dialogs_folder, exist_ok=True)
+    os.makedirs(objects_folder, exist_ok=True)
+    for m in range(1, maps + 1):
+        data = {"autoplayBgm": False, "displayName": gen.sentence(1, 3), "height": 13, "width": 17,
+                "events": [None] + [{"id": e, "name": "EV{:03d}".format(e), "note": "", "x": e % 17, "y": e % 13,
+                                     "pages": [{"list": gen.command_list(commands), "trigger": 0}
+                                               for _ in range(pages)]}
+                                    for e in range(1, events + 1)],
+                "data": [0] * 17 * 13 * 6}
+        with open(os.path.join(dialogs_folder, 'Map{:03d}.json'.format(m)), 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+    data = [None] + [{"id": i, "list": gen.command_list(commands), "name": "CE{:03d}".format(i), "switchId": 1,
+                      "trigger": 0} for i in range(1, common_events + 1)]
+    with open(os.path.join(dialogs_folder, 'CommonEvents.json'), 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    databases = {
+        'Actors.json': lambda i: {"id": i, "name": gen.random.choice(NAMES), "nickname": "",
+                                  "profile": gen.sentence(8, 20) + '\n' + gen.sentence(4, 10)},
+        'Items.json': lambda i: {"id": i, "name": gen.sentence(1, 3), "description": gen.sentence(6, 18)},
+        'Weapons.json': lambda i: {"id": i, "name": gen.sentence(1, 3), "description": gen.sentence(6, 18)},
+        'Armors.json': lambda i: {"id": i, "name": gen.sentence(1, 3), "description": gen.sentence(6, 18)},
+        'Skills.json': lambda i: {"id": i, "name": gen.sentence(1, 3), "description": gen.sentence(6, 18),
+                                  "message1": " " + gen.sentence(2, 5), "message2": ""},
+        'States.json': lambda i: {"id": i, "name": gen.sentence(1, 2), "message1": " " + gen.sentence(2, 5),
+                                  "message2": " " + gen.sentence(2, 5), "message3": "", "message4": ""},
+    }
+    for file, record in databases.items():
+        data = [None] + [record(i) for i in range(1, objects + 1)]
+        with open(os.path.join(objects_folder, file), 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+
+
+class _Timed:
+    """
+    Wraps a function accumulating the time spent in it
+    """
+
+    def __init__(self, function):
+        self.function = function
+        self.seconds = 0.0
+
+    def __call__(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self.function(*args, **kwargs)
+        finally:
+            self.seconds += time.perf_counter() - start
+
+
+def _path_calls(name, project):
+    dialogs_folder = os.path.join(project, 'dialogs')
+    objects_folder = os.path.join(project, 'objects')
+    maps = sorted(f for f in os.listdir(dialogs_folder) if f.startswith('Map'))
+    if name == 'translate':
+        return [(dialogs_translator.translate, {}, os.path.join(dialogs_folder, f)) for f in maps]
+    if name == 'translate_neatly':
+        return [(dialogs_translator.translate_neatly, {'max_len': 44}, os.path.join(dialogs_folder, f)) for f in maps]
+    if name == 'translate_neatly_common_events':
+        return [(dialogs_translator.translate_neatly_common_events, {'max_len': 55},
+                 os.path.join(dialogs_folder, 'CommonEvents.json'))]
+    return [(objects_translator.translate, {'max_len': 55}, os.path.join(objects_folder, f))
+            for f in sorted(os.listdir(objects_folder))]
+
+
+def _run_path(name, project, backend_kwargs, workers, pack_chars, max_retries):
+    """
+    Translate the files of a path, in a process of its own so that its peak memory is not mixed with the other paths
+    """
+    backend = OfflineBackend('reverse', **backend_kwargs)
+    calls = _path_calls(name, project)
+    engine = TranslationEngine(backend, max_retries=max_retries, workers=workers, pack_chars=pack_chars)
+    neatly_batch = dialogs_translator.print_neatly_batch = _Timed(dialogs_translator.print_neatly_batch)
+    neatly = objects_translator.print_neatly = _Timed(objects_translator.print_neatly)
+    segments = 0
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for function, kwargs, file_path in calls:
+            segments += function(file_path, None, engine=engine, **kwargs)[1]
+    engine.close()
+    seconds = time.perf_counter() - start
+    return {
+        'files': len(calls),
+        'segments': segments,
+        'seconds': round(seconds, 3),
+        'segments_per_second': round(segments / seconds, 1) if seconds > 0 else None,
+        'requests': backend.requests,
+        'print_neatly_seconds': round(neatly_batch.seconds + neatly.seconds, 3),
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def run_benchmark(project, latency=0.0, failure_rate=0.0, seed=0, workers=1, pack_chars=0, max_retries=5,
+                  max_batch=1):
+    """
+    Translate the dialogs of project with the three dialog paths and its objects, each path in a new process
+    @param max_batch : sentences per batch request of the offline backend, 1 (like Google Translate) to send the packs
+                       joined by the delimiter
+    @return : dict of results for each path
+    """
+    backend_kwargs = {'latency': latency, 'failure_rate': failure_rate, 'seed': seed, 'max_batch': max_batch}
+    results = {}
+    for name in PATHS:
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as process:
+            results[name] = process.submit(_run_path, name, project, backend_kwargs, workers, pack_chars,
+                                           max_retries).result()
+    return results
+
+
+# usage: python benchmark.py --maps 20 --events 50 --latency 0.05 --workers 8 --pack_chars 5000
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-p", "--project", type=str, default=None,
+                    help="folder of the synthetic project, generated in a temporary folder by default")
+    ap.add_argument("-m", "--maps", type=int, default=10)
+    ap.add_argument("-e", "--events", type=int, default=50)
+    ap.add_argument("-pg", "--pages", type=int, default=2)
+    ap.add_argument("-cm", "--commands", type=int, default=30)
+    ap.add_argument("-ce", "--common_events", type=int, default=100)
+    ap.add_argument("-ob", "--objects", type=int, default=200)
+    ap.add_argument("-r", "--repeat", type=float, default=0.3)
+    ap.add_argument("-s", "--seed", type=int, default=0)
+    ap.add_argument("-l", "--latency", type=float, default=0.0)
+    ap.add_argument("-f", "--failure_rate", type=float, default=0.0)
+    ap.add_argument("-w", "--workers", type=int, default=1)
+    ap.add_argument("-pc", "--pack_chars", type=int, default=0)
+    ap.add_argument("-mr", "--max_retries", type=int, default=5)
+    ap.add_argument("-mb", "--max_batch", type=int, default=1)
+    ap.add_argument("-o", "--output", type=str, default=None, help="write the results to this JSON file")
+    args = ap.parse_args()
+    project = args.project or tempfile.mkdtemp(prefix='rpgmaker-benchmark-')
+    try:
+        if not os.path.isdir(os.path.join(project, 'dialogs')):
+            print('generating synthetic project in {}'.format(project))
+            generate_project(project, args.maps, args.events, args.pages, args.commands, args.common_events,
+                             args.objects, args.repeat, args.seed)
+        results = run_benchmark(project, args.latency, args.failure_rate, args.seed, args.workers, args.pack_chars,
+                                args.max_retries, args.max_batch)
+    finally:
+        if args.project is None:
+            shutil.rmtree(project)
+    print('{:<32}{:>8}{:>10}{:>10}{:>12}{:>10}{:>16}{:>10}'.format(
+        'path', 'files', 'segments', 'seconds', 'segments/s', 'requests', 'print_neatly s', 'rss MB'))
+    for name, r in results.items():
+        print('{:<32}{:>8}{:>10}{:>10}{:>12}{:>10}{:>16}{:>10}'.format(
+            name, r['files'], r['segments'], r['seconds'], r['segments_per_second'], r['requests'],
+            r['print_neatly_seconds'], r['peak_rss_mb']))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=4)
@@ -0,0 +1,244 @@
+import argparse
+import heapq
+import json
+import os
+from array import array
+
+from backends import add_backend_arguments, backend_from_args
+from dialogs_translator import apply_translations, collect_file
+from objects_translator import apply_objects, collect_objects
+from rate_limiter import add_rate_arguments, rate_controller_from_args
+from segment_store import StringTable
+from translation_cache import TranslationCache
+from translation_engine import TranslationEngine
+
+
+def load_json(file_path):
+    with open(file_path, 'r', encoding='utf-8-sig') as f:
+        return json.load(f)
+
+
+def save_json(data, file_path, no_format=False):
+    with open(file_path, 'w', encoding='utf-8') as f:
+        if not no_format:
+            json.dump(data, f, indent=4, ensure_ascii=False)
+        else:
+            json.dump(data, f, ensure_ascii=False)
+
+
+def json_files(folder):
+    if not folder or not os.path.isdir(folder):
+        return []
+    return [os.path.join(folder, file) for file in sorted(os.listdir(folder)) if file.endswith('.json')]
+
+
+def extract(dialogs_folder='dialogs', objects_folder='objects', src='it', print_neatly=True, plugin_prefixes=()):
+    """
+    Collect the strings to translate of all the files of dialogs_folder and objects_folder
+    @param print_neatly : extract whole dialog windows, must match the value used to apply the catalog
+    @param plugin_prefixes : prefixes of the plugin commands whose text is extracted, kept in the catalog
+    @return : catalog with one entry for each distinct string
+    """
+    # distinct strings of the whole project and the number of times each one is used
+    texts = StringTable()
+    counts = array('l')
+
+    def count(text):
+        i = texts.id(text)
+        if i == len(counts):
+            counts.append(0)
+        counts[i] += 1
+
+    for file_path in json_files(dialogs_folder):
+        collected = collect_file(file_path, load_json(file_path), print_neatly, plugin_prefixes)
+        if collected is not None:
+            for job in collected[0]:
+                count(job[0])
+    for file_path in json_files(objects_folder):
+        for job in collect_objects(load_json(file_path), file_path):
+            count(job[2])
+    return {'source_lang': src, 'dest_lang': None, 'print_neatly': print_neatly,
+            'plugin_prefixes': list(plugin_prefixes),
+            'entries': [{'text': text, 'count': n, 'translation': None} for text, n in zip(texts, counts)]}
+
+
+def shard(catalog, n):
+    """
+    Split a catalog in n catalogs with about the same number of characters to translate
+    """
+    loads = [(0, i) for i in range(n)]
+    assigned = [[] for _ in range(n)]
+    # longest entries first, each one to the lightest shard
+    order = sorted(range(len(catalog['entries'])), key=lambda e: -len(catalog['entries'][e]['text']))
+    for e in order:
+        load, i = heapq.heappop(loads)
+        assigned[i].append(e)
+        heapq.heappush(loads, (load + len(catalog['entries'][e]['text']), i))
+    shards = []
+    for entries in assigned:
+        shard_catalog = dict(catalog)
+        shard_catalog['entries'] = [catalog['entries'][e] for e in sorted(entries)]
+        shards.append(shard_catalog)
+    return shards
+
+
+def translate(catalog, engine):
+    """
+    Translate in place the entries of the catalog without a translation. The translations of a catalog translated
+    in another language are discarded first.
+    @return : number of entries translated
+    """
+    if catalog['dest_lang'] not in (None, engine.dst):
+        print('discarding the {} translations of the catalog'.format(catalog['dest_lang']))
+        for entry in catalog['entries']:
+            entry['translation'] = None
+    entries = [entry for entry in catalog['entries'] if entry['translation'] is None]
+    results = engine.translate_all([entry['text'] for entry in entries])
+    translations = 0
+    for entry, (text_tr, success) in zip(entries, results):
+        if success:
+            entry['translation'] = text_tr
+            translations += 1
+    catalog['dest_lang'] = engine.dst
+    return translations
+
+
+def apply(catalogs, dialogs_folder='dialogs', objects_folder='objects', dst='en', max_len=44, objects_max_len=55,
+          no_format=False, verbose=False):
+    """
+    Write the translated files of dialogs_folder and objects_folder using the translations of the catalogs,
+    without translating anything
+    @return : number of strings translated
+    """
+    for catalog in catalogs:
+        if catalog['dest_lang'] != dst:
+            raise ValueError('a catalog is translated in {} instead of {}'.format(catalog['dest_lang'], dst))
+    if len(set(catalog['print_neatly'] for catalog in catalogs)) > 1:
+        raise ValueError('the catalogs were extracted with different print_neatly values')
+    if len(set(tuple(catalog.get('plugin_prefixes', ())) for catalog in catalogs)) > 1:
+        raise ValueError('the catalogs were extracted with different plugin commands')
+    translated = {}
+    print_neatly = catalogs[0]['print_neatly']
+    plugin_prefixes = tuple(catalogs[0].get('plugin_prefixes', ()))
+    for catalog in catalogs:
+        for entry in catalog['entries']:
+            if entry['translation'] is not None:
+                translated[entry['text']] = entry['translation']
+
+    def results(texts):
+        return [(translated[text], True) if text in translated else (text, False) for text in texts]
+
+    translations = 0
+    for folder, objects in ((dialogs_folder, False), (objects_folder, True)):
+        files = json_files(folder)
+        if not files:
+            continue
+        dest_folder = folder + '_' + dst
+        if not os.path.exists(dest_folder):
+            os.makedirs(dest_folder)
+        for file_path in files:
+            data = load_json(file_path)
+            if objects:
+                jobs = collect_objects(data, file_path)
+                translations += apply_objects(jobs, results([job[2] for job in jobs]), objects_max_len, verbose)
+            else:
+                collected = collect_file(file_path, data, print_neatly, plugin_prefixes)
+                if collected is None:
+                    continue
+                jobs = collected[0]
+                translations += apply_translations(jobs, results([job[0] for job in jobs]), max_len, verbose)
+            save_json(data, os.path.join(dest_folder, os.path.basename(file_path)), no_format)
+    return translations
+
+
+# usage:
+#   python catalog.py extract --print_neatly --source_lang it -o catalog.json
+#   python catalog.py shard catalog.json -n 4
+#   python catalog.py translate catalog_1.json --dest_lang en   (on each worker node)
+#   python catalog.py apply catalog_1_en.json catalog_2_en.json catalog_3_en.json catalog_4_en.json --dest_lang en
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    sub = ap.add_subparsers(dest="command", required=True)
+
+    ap_extract = sub.add_parser("extract")
+    ap_extract.add_argument("-d", "--dialogs_folder", type=str, default="dialogs")
+    ap_extract.add_argument("-ob", "--objects_folder", type=str, default="objects")
+    ap_extract.add_argument("-sl", "--source_lang", type=str, default="it")
+    ap_extract.add_argument("-pn", "--print_neatly", action="store_true", default=False)
+    ap_extract.add_argument("-pl", "--plugin_commands", type=str, default=None)
+    ap_extract.add_argument("-o", "--output", type=str, default="catalog.json")
+
+    ap_shard = sub.add_parser("shard")
+    ap_shard.add_argument("catalog", type=str)
+    ap_shard.add_argument("-n", "--shards", type=int, default=2)
+
+    ap_translate = sub.add_parser("translate")
+    ap_translate.add_argument("catalog", type=str)
+    ap_translate.add_argument("-dl", "--dest_lang", type=str, default="en")
+    ap_translate.add_argument("-mr", "--max_retries", type=int, default=10)
+    ap_translate.add_argument("-c", "--cache", type=str, default=None)
+    ap_translate.add_argument("-cs", "--cache_size", type=int, default=100000)
+    ap_translate.add_argument("-w", "--workers", type=int, default=1)
+    ap_translate.add_argument("-pc", "--pack_chars", type=int, default=0)
+    ap_translate.add_argument("-nm", "--no_mask", action="store_true", default=False)
+    add_backend_arguments(ap_translate)
+    add_rate_arguments(ap_translate)
+
+    ap_apply = sub.add_parser("apply")
+    ap_apply.add_argument("catalogs", type=str, nargs="+")
+    ap_apply.add_argument("-d", "--dialogs_folder", type=str, default="dialogs")
+    ap_apply.add_argument("-ob", "--objects_folder", type=str, default="objects")
+    ap_apply.add_argument("-dl", "--dest_lang", type=str, default="en")
+    ap_apply.add_argument("-ml", "--max_len", type=int, default=44)
+    ap_apply.add_argument("-oml", "--objects_max_len", type=int, default=55)
+    ap_apply.add_argument("-nf", "--no_format", action="store_true", default=False)
+    ap_apply.add_argument("-v", "--verbose", action="store_true", default=False)
+    args = ap.parse_args()
+
+    if args.command == "extract":
+        plugin_prefixes = [p for p in args.plugin_commands.split(',') if p] if args.plugin_commands else []
+        catalog = extract(args.dialogs_folder, args.objects_folder, args.source_lang, args.print_neatly,
+                          plugin_prefixes)
+        save_json(catalog, args.output)
+        print('extracted {} distinct strings ({} characters) in {}'.format(
+            len(catalog['entries']), sum(len(e['text']) for e in catalog['entries']), args.output))
+
+    elif args.command == "shard":
+        root, ext = os.path.splitext(args.catalog)
+        for i, shard_catalog in enumerate(shard(load_json(args.catalog), args.shards)):
+            shard_path = '{}_{}{}'.format(root, i + 1, ext)
+            save_json(shard_catalog, shard_path)
+            print('{}: {} strings, {} characters'.format(
+                shard_path, len(shard_catalog['entries']), sum(len(e['text']) for e in shard_catalog['entries'])))
+
+    elif args.command == "translate":
+        catalog = load_json(args.catalog)
+        previous_lang = catalog['dest_lang']
+        cache = TranslationCache(args.cache, max_entries=args.cache_size) if args.cache else None
+        backend = backend_from_args(args)
+        rate_control = rate_controller_from_args(args)
+        engine = TranslationEngine(backend, catalog['source_lang'], args.dest_lang, max_retries=args.max_retries,
+                                   cache=cache, workers=args.workers, pack_chars=args.pack_chars,
+                                   rate_control=rate_control, retry_rounds=args.retry_rounds, mask=not args.no_mask)
+        t = translate(catalog, engine)
+        engine.close()
+        backend.close()
+        print(rate_control)
+        if cache is not None:
+            cache.close()
+            print(cache)
+        # a catalog already translated in the same language is updated in place
+        output = args.catalog
+        if previous_lang != args.dest_lang:
+            root, ext = os.path.splitext(args.catalog)
+            if previous_lang is not None and root.endswith('_' + previous_lang):
+                root = root[:-len(previous_lang) - 1]
+            output = '{}_{}{}'.format(root, args.dest_lang, ext)
+        save_json(catalog, output)
+        print('translated {}/{} strings in {}'.format(t, len(catalog['entries']), output))
+
+    elif args.command == "apply":
+        catalogs = [load_json(catalog) for catalog in args.catalogs]
+        t = apply(catalogs, args.dialogs_folder, args.objects_folder, args.dest_lang, args.max_len,
+                  args.objects_max_len, args.no_format, args.verbose)
+        print('\ndone! translated in total {} strings'.format(t))
@@ -1,265 +1,346 @@
 import argparse
-import copy
+import contextlib
+import functools
 import json
+import operator
 import os
 import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
-from googletrans import Translator  # pip install googletrans==4.0.0rc1
+from backends import add_backend_arguments, backend_from_args
+from dry_run import DryRun, latency_from_metrics
+from event_commands import CommandVisitor
+from journal import TranslationJournal
+from json_stream import stream_json_array
+from manifest import TranslationManifest
+from metrics import Metrics, SamplingProfiler, add_metrics_arguments
+from pipeline import run_pipeline
+from print_neatly import print_neatly_batch
+from rate_limiter import add_rate_arguments, rate_controller_from_args
+from span_writer import SpanDocument
+from targets import parse_targets, target_path
+from translation_cache import TranslationCache
+from translation_engine import TranslationEngine
 
-from print_neatly import print_neatly
 
+# Each collect function appends to jobs the strings of an event to translate and to keys their journal keys
+# (file, event id, page index, list index, sub index), see event_commands for the format of the jobs.
+# The commands are dispatched on their code to the handlers registered in event_commands.COMMAND_HANDLERS,
+# so supporting a new command only requires registering its handler.
 
-def translate(file_path, tr, src='it', dst='en', verbose=False, max_retries=5):
 
-    def translate_sentence(text):
-        target = text
-        translation = tr.translate(target, src=src, dest=dst).text
-        if target[0].isalpha() and translation[0].isalpha and not target[0].isupper():
-            translation = translation[0].lower() + translation[1:]
-        text = translation
+def collect_event(events, file_key, jobs, keys, plugin_prefixes=(), codes=None):
+    CommandVisitor(file_key, jobs, keys, False, plugin_prefixes, codes).visit_pages(events['id'], events['pages'])
+
+
+def collect_event_neatly(events, file_key, jobs, keys, plugin_prefixes=(), codes=None):
+    CommandVisitor(file_key, jobs, keys, True, plugin_prefixes, codes).visit_pages(events['id'], events['pages'])
+
+
+def collect_common_event(d, file_key, jobs, keys, plugin_prefixes=(), codes=None):
+    CommandVisitor(file_key, jobs, keys, True, plugin_prefixes, codes).visit(d['list'], d['id'])
+
+
+def events_collector(file_key, print_neatly=True, plugin_prefixes=(), codes=None):
+    """
+    @param print_neatly : collect whole dialog windows instead of single rows in maps and troops
+    @param codes : list the code of the command of each job is appended to, or None
+    @return : (function returning the list of events of the loaded file, collect function of its events),
+              or None if the file does not contain dialogs
+    """
+    if file_key.startswith(('Map', 'Troops')):
+        collect = collect_event_neatly if print_neatly else collect_event
+    elif file_key.startswith('CommonEvents'):
+        collect = collect_common_event
+    else:
+        return None
+    if file_key.startswith('Map'):
+        events_of = operator.itemgetter('events')
+    else:
+        # CommonEvents and Troops are lists of events
+        events_of = list
+    return events_of, functools.partial(collect, plugin_prefixes=tuple(plugin_prefixes), codes=codes)
+
+
+def write_neatly(list, start, end, text_neat, verbose=False):
+    """
+    Spread the lines of a reflowed dialog window over the 401 commands list[start:end]
+    @return : number of rows written
+    """
+    for text_it, j in enumerate(range(start, end)):
+        if text_it >= len(text_neat):  # translated text is one row shorter
+            text_neat.append("")
         if verbose:
-            print(target, '->', translation)
-        return text
-
-    def try_translate_sentence(text):
-        try:
-            return (translate_sentence(text), True)
-        except:
-            for _ in range(max_retries):
-                try:
-                    time.sleep(1)
-                    return (translate_sentence(text), True)
-                except:
-                    pass
-            return (text, False)
+            print(list[j]['parameters'][0], "->", text_neat[text_it])
+        list[j]['parameters'][0] = text_neat[text_it]
+    return end - start
+
 
+def apply_translations(jobs, results, max_len=44, verbose=False, metrics=None):
+    """
+    Write back the translations of the collected jobs
+    @param metrics : Metrics or None, records the time spent in print_neatly
+    @return : number of strings translated
+    """
     translations = 0
+    windows = [text_tr for (_, _, _, _, anomaly), (text_tr, success) in zip(jobs, results)
+               if anomaly is None and success and text_tr is not None]
+    if metrics is not None:
+        with metrics.timer('print_neatly'):
+            windows_neat = iter(print_neatly_batch(windows, max_len))
+    else:
+        windows_neat = iter(print_neatly_batch(windows, max_len))
+    for (text, target, j, end, anomaly), (text_tr, success) in zip(jobs, results):
+        if anomaly is None:
+            if (not success) or (text_tr is None):
+                print('Anomaly: {}'.format(text))
+            else:
+                translations += write_neatly(target, j, end, next(windows_neat), verbose)
+        elif not success:
+            print(anomaly.format(text))
+        else:
+            if verbose:
+                print(text, '->', text_tr)
+            target[j] = text_tr
+            translations += 1
+    return translations
+
+
+def collect_file(file_path, data, print_neatly=True, plugin_prefixes=(), codes=None):
+    """
+    Collect the jobs of a loaded map, CommonEvents or Troops file
+    @param print_neatly : collect whole dialog windows instead of single rows in maps and troops
+    @param codes : list the code of the command of each job is appended to, or None
+    @return : (jobs, keys), or None if the file does not contain dialogs
+    """
+    file_key = os.path.basename(file_path)
+    collector = events_collector(file_key, print_neatly, plugin_prefixes, codes)
+    if collector is None:
+        return None
+    events_of, collect = collector
+    jobs = []
+    keys = []
+    for events in events_of(data):
+        if events is not None:
+            collect(events, file_key, jobs, keys)
+    return jobs, keys
+
+
+def extract_file(file_path, print_neatly=True, plugin_prefixes=()):
+    """
+    First stage of the pipeline: load a map, CommonEvents or Troops file and collect its sentences
+    @return : (texts, keys), or None if the file does not contain dialogs
+    """
     with open(file_path, 'r', encoding='utf-8-sig') as datafile:
-        data = json.load(datafile)
-    num_events = len([e for e in data["events"] if e is not None])
-    i = 0
-    for events in data["events"]:
+        collected = collect_file(file_path, json.load(datafile), print_neatly, plugin_prefixes)
+    if collected is None:
+        return None
+    jobs, keys = collected
+    return [job[0] for job in jobs], keys
+
+
+def write_file(file_path, new_file, print_neatly, plugin_prefixes, max_len, verbose, indent, keep_format, results):
+    """
+    Last stage of the pipeline: load the file again, apply the results of the translation of the sentences returned
+    by extract_file and write the translated file
+    @param keep_format : replace only the translated strings in a copy of the original file
+    @return : number of strings translated
+    """
+    document = SpanDocument(file_path) if keep_format else None
+    if document is not None:
+        data = document.data
+    else:
+        with open(file_path, 'r', encoding='utf-8-sig') as datafile:
+            data = json.load(datafile)
+    jobs, _ = collect_file(file_path, data, print_neatly, plugin_prefixes)
+    translations = apply_translations(jobs, results, max_len, verbose)
+    if document is not None:
+        document.save(new_file)
+    else:
+        with open(new_file, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=indent, ensure_ascii=False)
+    return translations
+
+
+def job_slots(job):
+    """
+    @return : list of (container, index) of the strings written when the job is applied
+    """
+    text, target, j, end, anomaly = job
+    if anomaly is None:
+        return [(target[k]['parameters'], 0) for k in range(j, end)]
+    return [(target, j)]
+
+
+def translate_events(events_list, collect, file_path, engine, journal=None, max_len=44, verbose=False,
+                     manifest=None, previous=None):
+    """
+    Translate in place a list of map events or common events
+    @param collect : collect function used for each event
+    @param manifest : TranslationManifest or None, segments unchanged since the previous run are not translated again
+    @param previous : events of the previous translated file, unchanged segments are copied from it so that
+                      translations edited by hand are preserved
+    @return : number of strings translated
+    """
+    jobs = []
+    keys = []
+    # the manifest records the code of the command of each segment
+    codes = [] if manifest is not None else None
+    file_key = os.path.basename(file_path)
+    for events in events_list:
         if events is not None:
-            print('{}: {}/{}'.format(file_path, i+1, num_events))
-            i += 1
-            for pages in events['pages']:
-                for list in pages['list']:
-
-                    # Plain text (ex: ["plain text"])
-                    if list['code'] == 401:
-                        # null or empty string check
-                        if not list['parameters'][0]:
-                            continue
-                        # translate
-                        list['parameters'][0], success = try_translate_sentence(list['parameters'][0])
-                        if not success:
-                            print('Anomaly plain text: {}'.format(list['parameters'][0]))
-                        else:
-                            translations += 1
-
-                    # Choices (ex: [["yes", "no"], 1, 0, 2, 0])
-                    elif list['code'] == 102:
-                        # null or empty list check
-                        if not list['parameters'][0]:
-                            continue
-                        # translate list
-                        for j, choice in enumerate(list['parameters'][0]):
-                            # null or empty string check
-                            if not choice:
-                                continue
-                            # translate
-                            list['parameters'][0][j], success = try_translate_sentence(choice)
-                            if not success:
-                                print('Anomaly choices: {}'.format(choice))
-                            else:
-                                translations += 1
-
-                    # Choices (answer) (ex: [0, "yes"])
-                    elif list['code'] == 402:
-                        # invalid length null or empty string check
-                        if len(list['parameters']) != 2 or not list['parameters'][1]:
-                            print('Anomaly choices (answer) - Unexpected 402 Code: {}'.format(list['parameters']))
-                            continue
-                        # translate
-                        list['parameters'][1], success = try_translate_sentence(list['parameters'][1])
-                        if not success:
-                            print('Anomaly choices (answer): {}'.format(list['parameters'][1]))
-                        else:
-                            translations += 1
-    return data, translations
+            collect(events, file_key, jobs, keys, codes=codes)
 
+    # reuse the segments unchanged since the previous run
+    reused = {}
+    if manifest is not None:
+        previous_slots = {}
+        if previous is not None:
+            previous_jobs = []
+            previous_keys = []
+            for events in previous:
+                if events is not None:
+                    collect(events, file_key, previous_jobs, previous_keys)
+            previous_slots = dict(zip(previous_keys, map(job_slots, previous_jobs)))
+        for j, (job, key) in enumerate(zip(jobs, keys)):
+            outputs = manifest.get(key, job[0])
+            if outputs is None:
+                continue
+            slots = previous_slots.get(key)
+            if slots is not None and len(slots) == len(outputs):
+                outputs = [container[k] for container, k in slots]
+            reused[j] = outputs
 
-def translate_neatly(file_path, tr, src='it', dst='en', verbose=False, max_len=40, max_retries=5):
-
-    def translate_sentence(text):
-        target = text
-        translation = tr.translate(target, src=src, dest=dst).text
-        if target[0].isalpha() and translation[0].isalpha and not target[0].isupper():
-            translation = translation[0].lower() + translation[1:]
-        text = translation
-        return text
-
-    def try_translate_sentence(text):
-        try:
-            return (translate_sentence(text), True)
-        except:
-            for _ in range(max_retries):
-                try:
-                    time.sleep(1)
-                    return (translate_sentence(text), True)
-                except:
-                    pass
-            return (text, False)
+    pending = [j for j in range(len(jobs)) if j not in reused]
+    results = engine.translate_all([jobs[j][0] for j in pending], [keys[j] for j in pending], journal)
+    translations = apply_translations([jobs[j] for j in pending], results, max_len, verbose, engine.metrics)
+    for j, outputs in reused.items():
+        for (container, k), output in zip(job_slots(jobs[j]), outputs):
+            container[k] = output
+        translations += len(outputs)
 
-    translations = 0
-    with open(file_path, 'r', encoding='utf-8-sig') as datafile:
-        data = json.load(datafile)
-    num_events = len([e for e in data["events"] if e is not None])
-    i = 0
-    for events in data["events"]:
+    if manifest is not None:
+        succeeded = set(reused)
+        succeeded.update(j for j, (_, success) in zip(pending, results) if success)
+        for j in sorted(succeeded):
+            manifest.add(keys[j], jobs[j][0], [container[k] for container, k in job_slots(jobs[j])], codes[j])
+    return translations
+
+
+def translate_targets(events_list, collect, file_path, engines, write, journals=None, max_lens=None, verbose=False):
+    """
+    Translate a list of map events or common events in several languages collecting their strings only once.
+    The translations run concurrently, then the translations of each language are applied and written in turn and the
+    events are restored to their original text before the next language.
+    @param engines : dict of the TranslationEngine of each destination language
+    @param write : function called with the language once its translations are applied, it writes the translated file
+    @param journals : dict of the TranslationJournal of each language, if any
+    @param max_lens : dict of the length of the dialog windows of each language
+    @return : dict of the number of strings translated in each language
+    """
+    journals = journals or {}
+    jobs = []
+    keys = []
+    file_key = os.path.basename(file_path)
+    for events in events_list:
         if events is not None:
-            print('{}: {}/{}'.format(file_path, i+1, num_events))
-            i += 1
-            for pages in events['pages']:
-                len_list = len(pages['list'])
-                list_it = 0
-                while list_it < len_list:
-                    # 102 Choices (dont nestly translate) (ex: [["yes", "no"], 1, 0, 2, 0])
-                    if pages['list'][list_it]['code'] == 102:
-                        # null or empty list check
-                        if not pages['list'][list_it]['parameters'][0]:
-                            list_it += 1
-                            continue
-                        # translate list
-                        for j, choice in enumerate(pages['list'][list_it]['parameters'][0]):
-                            # null or empty string check
-                            if not choice:
-                                print('Anomaly choices - Unexpected 102 code: {}'.format(choice))
-                                continue
-                            # translate
-                            pages['list'][list_it]['parameters'][0][j], success = try_translate_sentence(choice)
-                            if not success:
-                                print('Anomaly choices: {}'.format(choice))
-                            else:
-                                translations += 1
-                        list_it += 1
-
-                    # 402 Choices (answer) (dont nestly translate) (ex: [0, "yes"])
-                    elif pages['list'][list_it]['code'] == 402:
-                        # invalid length null or empty string check
-                        if len(pages['list'][list_it]['parameters']) != 2 or not pages['list'][list_it]['parameters'][1]:
-                            print('Anomaly choices (answer) - Unexpected 402 Code: {}'.format(pages['list'][list_it]['parameters']))
-                            list_it += 1
-                            continue
-                        # translate
-                        pages['list'][list_it]['parameters'][1], success = try_translate_sentence(pages['list'][list_it]['parameters'][1])
-                        if not success:
-                            print('Anomaly choices (answer): {}'.format(pages['list'][list_it]['parameters'][1]))
-                        else:
-                            translations += 1
-                        list_it += 1
-
-                    # 401 Plain text (to nestly translate) (ex: ["plain text"])
-                    elif pages['list'][list_it]['code'] == 401:
-                        list_it_2 = list_it + 1
-                        text = copy.deepcopy(pages['list'][list_it]['parameters'])
-                        while pages['list'][list_it_2]['code'] == 401:
-                            text.append(pages['list'][list_it_2]['parameters'][0])
-                            list_it_2 += 1
-                        text = ' '.join(text)
-                        # empty string check
-                        if not text:
-                            list_it = list_it_2
-                            continue
-                        # translate
-                        text_tr, success = try_translate_sentence(text)
-                        if (not success) or (text_tr is None):
-                            print('Anomaly: {}'.format(text))
-                        else:
-                            try:
-                                text_neat = print_neatly(text_tr, max_len)
-                            except:
-                                text_neat = text_tr
-                            for text_it, j in enumerate(range(list_it, list_it_2)):
-                                translations += 1
-                                if text_it >= len(text_neat):  # translated text is one row shorter
-                                    text_neat.append("")
-                                if verbose:
-                                    print(pages['list'][j]['parameters'][0], "->", text_neat[text_it])
-                                pages['list'][j]['parameters'][0] = text_neat[text_it]
-                        list_it = list_it_2
-                    else:
-                        list_it += 1
+            collect(events, file_key, jobs, keys)
+    texts = [job[0] for job in jobs]
+    originals = [[container[k] for container, k in job_slots(job)] for job in jobs]
+    translations = {}
+    with ThreadPoolExecutor(max_workers=len(engines)) as languages_pool:
+        futures = {lang: languages_pool.submit(engine.translate_all, texts, keys, journals.get(lang))
+                   for lang, engine in engines.items()}
+        for lang, future in futures.items():
+            translations[lang] = apply_translations(jobs, future.result(), max_lens[lang], verbose,
+                                                    engines[lang].metrics)
+            write(lang)
+            for job, values in zip(jobs, originals):
+                for (container, k), value in zip(job_slots(job), values):
+                    container[k] = value
+    return translations
+
+
+def translate(file_path, tr, src='it', dst='en', verbose=False, max_retries=5, cache=None, engine=None,
+              journal=None, manifest=None, previous=None, data=None, plugin_prefixes=()):
+    if engine is None:
+        engine = TranslationEngine(tr, src, dst, max_retries=max_retries, cache=cache)
+    # data is given when the file has already been loaded (ex: by a SpanDocument)
+    if data is None:
+        with open(file_path, 'r', encoding='utf-8-sig') as datafile, engine.metrics.timer('json_load'):
+            data = json.load(datafile)
+    collect = functools.partial(collect_event, plugin_prefixes=plugin_prefixes)
+    translations = translate_events(data['events'], collect, file_path, engine, journal, verbose=verbose,
+                                    manifest=manifest, previous=previous and previous['events'])
     return data, translations
 
 
-def translate_neatly_common_events(file_path, tr, src='it', dst='en', verbose=False, max_len=55, max_retries=5):
+def translate_neatly(file_path, tr, src='it', dst='en', verbose=False, max_len=40, max_retries=5, cache=None,
+                     engine=None, journal=None, manifest=None, previous=None, data=None, plugin_prefixes=()):
+    if engine is None:
+        engine = TranslationEngine(tr, src, dst, max_retries=max_retries, cache=cache)
+    # data is given when the file has already been loaded (ex: by a SpanDocument)
+    if data is None:
+        with open(file_path, 'r', encoding='utf-8-sig') as datafile, engine.metrics.timer('json_load'):
+            data = json.load(datafile)
+    collect = functools.partial(collect_event_neatly, plugin_prefixes=plugin_prefixes)
+    translations = translate_events(data['events'], collect, file_path, engine, journal, max_len,
+                                    verbose, manifest=manifest, previous=previous and previous['events'])
+    return data, translations
 
-    def translate_sentence(text):
-        target = text
-        translation = tr.translate(target, src=src, dest=dst).text
-        if target[0].isalpha() and translation[0].isalpha and not target[0].isupper():
-            translation = translation[0].lower() + translation[1:]
-        text = translation
-        return text
 
-    translations = 0
-    with open(file_path, 'r', encoding='utf-8-sig') as datafile:
-        data = json.load(datafile)
-    num_ids = len([e for e in data if e is not None])
-    i = 0
-    for d in data:
-        if d is not None:
-            print('{}: {}/{}'.format(file_path, i+1, num_ids))
-            i += 1
-            list_it = 0
-            len_list = len(d['list'])
-            while list_it < len_list:
-                if 'code' in d['list'][list_it].keys() and d['list'][list_it]['code'] == 401:
-                    list_it_2 = list_it + 1
-                    text = copy.deepcopy(d['list'][list_it]['parameters'])
-                    while 'code' in d['list'][list_it].keys() and d['list'][list_it_2]['code'] == 401:
-                        text.append(d['list'][list_it_2]['parameters'][0])
-                        list_it_2 += 1
-                    text = ' '.join(text)
-                    # empty string check
-                    if not text:
-                        list_it = list_it_2
-                        continue
-                    text_tr = None
-                    try:
-                        text_tr = translate_sentence(text)
-                    except:
-                        for _ in range(max_retries):
-                            try:
-                                time.sleep(1)
-                                text_tr = translate_sentence(text)
-                            except:
-                                pass
-                            if text_tr is not None:
-                                break
-                    if text_tr is None:
-                        print('Anomaly: {}'.format(text))
-                    else:
-                        try:
-                            text_neat = print_neatly(text_tr, max_len)
-                        except:
-                            text_neat = text_tr
-                        for text_it, j in enumerate(range(list_it, list_it_2)):
-                            translations += 1
-                            if text_it >= len(text_neat):
-                                text_neat.append("")
-                            if verbose:
-                                print(d['list'][j]['parameters'][0], "->", text_neat[text_it])
-                            d['list'][j]['parameters'][0] = text_neat[text_it]
-                    list_it = list_it_2
-                else:
-                    list_it += 1
+def translate_neatly_common_events(file_path, tr, src='it', dst='en', verbose=False, max_len=55, max_retries=5,
+                                   cache=None, engine=None, journal=None, manifest=None, previous=None, data=None,
+                                   plugin_prefixes=()):
+    if engine is None:
+        engine = TranslationEngine(tr, src, dst, max_retries=max_retries, cache=cache)
+    # data is given when the file has already been loaded (ex: by a SpanDocument)
+    if data is None:
+        with open(file_path, 'r', encoding='utf-8-sig') as datafile, engine.metrics.timer('json_load'):
+            data = json.load(datafile)
+    collect = functools.partial(collect_common_event, plugin_prefixes=plugin_prefixes)
+    translations = translate_events(data, collect, file_path, engine, journal, max_len, verbose,
+                                    manifest=manifest, previous=previous)
     return data, translations
 
 
+def translate_stream(file_path, new_file, collect, engine, journal=None, max_len=44, verbose=False, indent=4,
+                     chunk_events=1, manifest=None):
+    """
+    Translate a map, CommonEvents or Troops file without loading it entirely: events are read, translated and written to
+    new_file in chunks of chunk_events, so the memory used is bounded by the size of the events of a chunk
+    (by the largest event with the default of one event per chunk)
+    @param collect : collect function used for each event
+    @param manifest : TranslationManifest or None, unchanged segments are copied from the manifest
+                      (translations edited by hand in the previous translated file are not preserved in this mode)
+    @return : number of strings translated
+    """
+    translations = 0
+
+    def translate_chunks(events):
+        nonlocal translations
+        chunk = []
+        for event in events:
+            chunk.append(event)
+            if len(chunk) >= chunk_events:
+                translations += translate_events(chunk, collect, file_path, engine, journal, max_len, verbose,
+                                                 manifest)
+                yield from chunk
+                chunk = []
+        translations += translate_events(chunk, collect, file_path, engine, journal, max_len, verbose, manifest)
+        yield from chunk
+
+    # the file is complete only once renamed, so an interrupted run never leaves a file that would be skipped
+    part_file = new_file + '.part'
+    stream_json_array(file_path, part_file, translate_chunks, array_key='events', indent=indent)
+    os.replace(part_file, new_file)
+    return translations
+
+
 # usage: python dialogs_translator.py --print_neatly --source_lang it --dest_lang en
+#        python dialogs_translator.py --print_neatly --source_lang it --dest_lang en,fr,de --max_len 44,de:48
 if __name__ == '__main__':
     ap = argparse.ArgumentParser()
     ap.add_argument("-i", "--input_folder", type=str, default="dialogs")
@@ -267,39 +348,207 @@ if __name__ == '__main__':
     ap.add_argument("-dl", "--dest_lang", type=str, default="en")
     ap.add_argument("-v", "--verbose", action="store_true", default=False)
     ap.add_argument("-nf", "--no_format", action="store_true", default=False)
+    ap.add_argument("-kf", "--keep_format", action="store_true", default=False)
     ap.add_argument("-pn", "--print_neatly", action="store_true", default=False)
-    ap.add_argument("-ml", "--max_len", type=int, default=44)
+    ap.add_argument("-ml", "--max_len", type=str, default="44")
     ap.add_argument("-mr", "--max_retries", type=int, default=10)
+    ap.add_argument("-c", "--cache", type=str, default=None)
+    ap.add_argument("-cs", "--cache_size", type=int, default=100000)
+    ap.add_argument("-w", "--workers", type=int, default=1)
+    ap.add_argument("-j", "--journal", type=str, default=None)
+    ap.add_argument("-st", "--stream", action="store_true", default=False)
+    ap.add_argument("-ce", "--chunk_events", type=int, default=1)
+    ap.add_argument("-pc", "--pack_chars", type=int, default=0)
+    ap.add_argument("-nm", "--no_mask", action="store_true", default=False)
+    ap.add_argument("-pp", "--processes", type=int, default=0)
+    ap.add_argument("-if", "--in_flight", type=int, default=0)
+    ap.add_argument("-mf", "--manifest", type=str, default=None)
+    ap.add_argument("-pl", "--plugin_commands", type=str, default=None)
+    ap.add_argument("-dr", "--dry_run", "--dry-run", action="store_true", default=False)
+    ap.add_argument("-ef", "--eta_from", type=str, default=None)
+    add_backend_arguments(ap)
+    add_rate_arguments(ap)
+    add_metrics_arguments(ap)
     args = ap.parse_args()
-    dest_folder = args.input_folder + '_' + args.dest_lang
-    translations = 0
-    if not os.path.exists(dest_folder):
-        os.makedirs(dest_folder)
+    try:
+        # max_len of each destination language
+        targets = parse_targets(args.dest_lang, args.max_len)
+    except ValueError as e:
+        ap.error(str(e))
+    several = len(targets) > 1
+    if args.processes > 0 and (args.stream or args.manifest):
+        ap.error('--processes cannot be used with --stream or --manifest')
+    if args.stream and args.keep_format:
+        ap.error('--keep_format cannot be used with --stream')
+    if several and (args.stream or args.manifest or args.processes > 0):
+        ap.error('several --dest_lang cannot be used with --stream, --manifest or --processes')
+    metrics = Metrics(args.progress_interval)
+    cache = TranslationCache(args.cache, max_entries=args.cache_size) if args.cache else None
+    # a single backend (and its pool of clients) is shared by all the files
+    backend = backend_from_args(args)
+    # the rate control is shared too, so throttling seen by a file slows down all the others
+    rate_control = rate_controller_from_args(args)
+    # one engine by language, all sharing the backend, the cache, the rate control and the metrics
+    # the engines share the slots of the requests too, so there are at most `workers` requests in flight in total
+    slots = threading.Semaphore(args.workers)
+    engines = {lang: TranslationEngine(backend, args.source_lang, lang, max_retries=args.max_retries, cache=cache,
+                                       workers=args.workers, pack_chars=args.pack_chars, rate_control=rate_control,
+                                       retry_rounds=args.retry_rounds, metrics=metrics, mask=not args.no_mask,
+                                       slots=slots)
+               for lang in targets}
+    # with several languages each one has its own journal (ex: journal_fr.jsonl)
+    journals = {lang: TranslationJournal(target_path(args.journal, lang, several), lang)
+                for lang in targets} if args.journal else {}
+    # the single language paths (stream, manifest, processes) use the first language
+    dest_lang, max_len = next(iter(targets.items()))
+    engine = engines[dest_lang]
+    journal = journals.get(dest_lang)
+    manifest = TranslationManifest(args.manifest, dest_lang) if args.manifest else None
+    # prefixes of the plugin commands whose text is translated (ex: "ShowInfo ,Quest Add ")
+    plugin_prefixes = tuple(p for p in args.plugin_commands.split(',') if p) if args.plugin_commands else ()
+    dest_folders = {lang: args.input_folder + '_' + lang for lang in targets}
+    dest_folder = dest_folders[dest_lang]
+    for folder in dest_folders.values():
+        if not args.dry_run and not os.path.exists(folder):
+            os.makedirs(folder)
+
+    def write_json(data, new_file):
+        with open(new_file, 'w', encoding='utf-8') as f:
+            if not args.no_format:
+                json.dump(data, f, indent=4, ensure_ascii=False)
+            else:
+                json.dump(data, f, ensure_ascii=False)
+
+    def translate_file_targets(file, file_path, events_of, collect):
+        # the languages the file has not been translated in yet
+        langs = [lang for lang in targets if not os.path.isfile(os.path.join(dest_folders[lang], file))]
+        document = None
+        if args.keep_format:
+            with metrics.timer('json_load'):
+                document = SpanDocument(file_path)
+            data = document.data
+        else:
+            with open(file_path, 'r', encoding='utf-8-sig') as datafile, metrics.timer('json_load'):
+                data = json.load(datafile)
+
+        def write(lang):
+            new_file = os.path.join(dest_folders[lang], file)
+            with metrics.timer('json_dump'):
+                if document is not None:
+                    document.save(new_file)
+                else:
+                    write_json(data, new_file)
+
+        translations = translate_targets(events_of(data), collect, file_path, {lang: engines[lang] for lang in langs},
+                                         write, journals, targets, args.verbose)
+        return sum(translations.values())
+
+    def translate_file(file):
+        file_path = os.path.join(args.input_folder, file)
+        new_file = os.path.join(dest_folder, file)
+        print('translating file: {}'.format(file_path))
+        collector = events_collector(file, args.print_neatly, plugin_prefixes)
+        if collector is None:
+            return 0
+        events_of, collect = collector
+        if several:
+            return translate_file_targets(file, file_path, events_of, collect)
+        if args.stream:
+            t = translate_stream(file_path, new_file, collect, engine, journal, max_len, args.verbose,
+                                 indent=None if args.no_format else 4, chunk_events=args.chunk_events,
+                                 manifest=manifest)
+            if manifest is not None:
+                manifest.save(file)
+            return t
+        # with a manifest the previous translation of the file is updated
+        previous = None
+        if manifest is not None and os.path.isfile(new_file):
+            with open(new_file, 'r', encoding='utf-8-sig') as f, metrics.timer('json_load'):
+                previous = json.load(f)
+        document = None
+        if args.keep_format:
+            with metrics.timer('json_load'):
+                document = SpanDocument(file_path)
+            new_data = document.data
+        else:
+            with open(file_path, 'r', encoding='utf-8-sig') as datafile, metrics.timer('json_load'):
+                new_data = json.load(datafile)
+        t = translate_events(events_of(new_data), collect, file_path, engine, journal, max_len, args.verbose,
+                             manifest, previous and events_of(previous))
+        with metrics.timer('json_dump'):
+            if document is not None:
+                document.save(new_file)
+            else:
+                write_json(new_data, new_file)
+        if manifest is not None:
+            manifest.save(file)
+        return t
+
+    def measure_file(file):
+        start = time.perf_counter()
+        t = translate_file(file)
+        metrics.file_done(file, t, time.perf_counter() - start)
+        print('translated file: {} ({} dialog windows)'.format(os.path.join(args.input_folder, file), t))
+        return t
+
+    files = []
     for file in os.listdir(args.input_folder):
         file_path = os.path.join(args.input_folder, file)
-        if os.path.isfile(os.path.join(dest_folder, file)):
+        if manifest is None and all(os.path.isfile(os.path.join(folder, file)) for folder in dest_folders.values()):
             print('skipped file {} because it has already been translated'.format(file_path))
             continue
         if file.endswith('.json'):
-            print('translating file: {}'.format(file_path))
-            if file.startswith('Map'):
-                if args.print_neatly:
-                    new_data, t = translate_neatly(file_path, tr=Translator(), max_len=args.max_len,
-                                                   src=args.source_lang, dst=args.dest_lang, verbose=args.verbose,
-                                                   max_retries=args.max_retries)
-                else:
-                    new_data, t = translate(file_path, tr=Translator(),
-                                            src=args.source_lang, dst=args.dest_lang, verbose=args.verbose,
-                                            max_retries=args.max_retries)
-            elif file.startswith('CommonEvents'):
-                new_data, t = translate_neatly_common_events(file_path, tr=Translator(), max_len=args.max_len,
-                                               src=args.source_lang, dst=args.dest_lang, verbose=args.verbose,
-                                               max_retries=args.max_retries)
-            translations += t
-            new_file = os.path.join(dest_folder, file)
-            with open(new_file, 'w', encoding='utf-8') as f:
-                if not args.no_format:
-                    json.dump(new_data, f, indent=4, ensure_ascii=False)
-                else:
-                    json.dump(new_data, f, ensure_ascii=False)
+            files.append(file)
+    if args.dry_run:
+        # the files are only collected, nothing is sent nor written
+        dry_runs = {lang: DryRun(engines[lang], journals.get(lang)) for lang in targets}
+        for file in files:
+            file_path = os.path.join(args.input_folder, file)
+            codes = []
+            with open(file_path, 'r', encoding='utf-8-sig') as datafile:
+                collected = collect_file(file_path, json.load(datafile), args.print_neatly, plugin_prefixes, codes)
+            if collected is not None:
+                jobs, keys = collected
+                for dry_run in dry_runs.values():
+                    dry_run.add_file(file, [job[0] for job in jobs], codes, keys)
+        for lang, dry_run in dry_runs.items():
+            if several:
+                print('\n{}:'.format(lang))
+            print(dry_run.report(args.eta_from and latency_from_metrics(args.eta_from), args.rate))
+        for engine in engines.values():
+            engine.close()
+        if cache is not None:
+            cache.close()
+        sys.exit()
+    # several files are translated at the same time, the engine bounds the number of requests in flight
+    with SamplingProfiler() if args.profile else contextlib.nullcontext() as profiler:
+        if args.processes > 0:
+            # parsing, reflow and serialization in other processes, only the translation in this one
+            tasks = [(os.path.join(args.input_folder, file), extract_file,
+                      (os.path.join(args.input_folder, file), args.print_neatly, plugin_prefixes), write_file,
+                      (os.path.join(args.input_folder, file), os.path.join(dest_folder, file), args.print_neatly,
+                       plugin_prefixes, max_len, args.verbose, None if args.no_format else 4, args.keep_format))
+                     for file in files if events_collector(file) is not None]
+            translations = run_pipeline(tasks, engine, args.processes, args.in_flight, journal)
+        else:
+            with ThreadPoolExecutor(max_workers=args.workers) as files_pool:
+                translations = sum(files_pool.map(measure_file, files))
+    for engine in engines.values():
+        engine.close()
+    backend.close()
+    print(rate_control)
+    print(metrics)
+    if profiler is not None:
+        print(profiler)
+    if args.metrics_out:
+        metrics.save(args.metrics_out, rate_control=rate_control.to_dict(), profile=profiler and profiler.to_dict())
+    for journal in journals.values():
+        journal.close()
+        print(journal)
+    if manifest is not None:
+        manifest.close()
+        print(manifest)
+    if cache is not None:
+        cache.close()
+        print(cache)
     print('\ndone! translated in total {} dialog windows'.format(translations))
@@ -0,0 +1,92 @@
+import collections
+import datetime
+import json
+import os
+
+from masking import mask_codes
+
+
+def latency_from_metrics(path):
+    """
+    @param path : metrics file written by --metrics_out in a previous run
+    @return : mean latency of the translation requests of that run in seconds, or None if it did not send any
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        metrics = json.load(f)
+    return metrics.get('histograms', {}).get('request', {}).get('mean_seconds')
+
+
+class DryRun:
+    """
+    Estimates the cost of translating files with an engine without sending any request: segments by file and by
+    code, characters, and requests given the packing, the cache and the journal, as the real run would send them
+    @param engine : TranslationEngine configured as for the real run, it is only used to pack the sentences
+                    and to look them up in its cache
+    @param journal : TranslationJournal or None, sentences already journaled are not counted in the requests
+    """
+
+    def __init__(self, engine, journal=None):
+        self.engine = engine
+        self.journal = journal
+        self.files = {}
+        self.codes = collections.Counter()
+        self.characters = 0
+        self.requests = 0
+        # templates translated by the previous files, with a cache they are not requested again
+        self._seen = set()
+        self._unique_characters = 0
+
+    def add_file(self, file, texts, codes, keys=None):
+        """
+        @param texts : sentences the file would send to engine.translate_all
+        @param codes : code (ex: 401) or field of each sentence
+        @param keys : journal keys of the sentences, if any
+        """
+        engine = self.engine
+        characters = sum(len(text) for text in texts)
+        if self.journal is not None and keys is not None:
+            texts = [text for text, key in zip(texts, keys) if self.journal.get(key, text) is None]
+        # as in translate_all, sentences differing only by their control codes are sent once
+        templates = dict.fromkeys(mask_codes(text)[0] if engine.mask else text for text in texts)
+        for template in templates:
+            if template not in self._seen:
+                self._unique_characters += len(template)
+        pending = [template for template in templates
+                   if engine.cache is None or
+                   (template not in self._seen and (template, engine.src, engine.dst) not in engine.cache)]
+        self._seen.update(templates)
+        requests = len(engine.make_packs(pending)) if engine.pack_chars > 0 else len(pending)
+        self.files[file] = (collections.Counter(codes), characters, requests)
+        self.codes.update(codes)
+        self.characters += characters
+        self.requests += requests
+
+    def eta(self, latency, rate=0.0):
+        """
+        @param latency : mean seconds per request
+        @param rate : requests per second allowed by the rate control, 0 if unlimited
+        @return : estimated seconds to send all the requests with the workers of the engine
+        """
+        seconds = self.requests * latency / self.engine.workers
+        if rate > 0:
+            seconds = max(seconds, self.requests / rate)
+        return seconds
+
+    def report(self, latency=None, rate=0.0):
+        def by_code(counter):
+            return ', '.join('{}: {}'.format(code, n) for code, n in sorted(counter.items(), key=lambda c: str(c[0])))
+
+        lines = ['dry run, no request sent:']
+        for file, (codes, characters, requests) in sorted(self.files.items()):
+            lines.append('  {}: {} segments ({}), {} characters, {} requests'.format(
+                os.path.basename(file), sum(codes.values()), by_code(codes), characters, requests))
+        lines.append('total: {} segments in {} files, {} characters ({} unique), {} requests'.format(
+            sum(self.codes.values()), len(self.files), self.characters, self._unique_characters, self.requests))
+        lines.append('segments by code: {}'.format(by_code(self.codes)))
+        if latency is None:
+            lines.append('ETA: unknown, give the metrics of a previous run with --eta_from')
+        else:
+            seconds = self.eta(latency, rate)
+            lines.append('ETA: {} at {:.3f} s per request with {} workers'.format(
+                datetime.timedelta(seconds=round(seconds)), latency, self.engine.workers))
+        return '\n'.join(lines)
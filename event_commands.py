@@ -0,0 +1,153 @@
+# Event commands containing text to translate, dispatched on their code by a table of handlers.
+# A handler is called with (visitor, commands, i) where commands[i] has the code it was registered for and returns
+# the index of the next command to visit, so a handler can consume several commands (ex: the 401 rows of a window).
+# Handlers add jobs with visitor.add, a job is a tuple (text, target, index, end, anomaly):
+#   - (text, container, index of the string to translate, None, anomaly message) for single strings
+#   - (text, list, first row index, last row index + 1, None) for dialog windows to print neatly
+
+COMMAND_HANDLERS = {}
+
+
+def command_handler(*codes):
+    """
+    Register the decorated function as the handler of the event commands with the given codes
+    """
+    def register(handler):
+        for code in codes:
+            COMMAND_HANDLERS[code] = handler
+        return handler
+    return register
+
+
+class PrefixedSlot:
+    """
+    Exposes as slot 0 the part after prefix of parameters[0], so that only the text of a plugin command is translated
+    """
+    __slots__ = ('parameters', 'prefix')
+
+    def __init__(self, parameters, prefix):
+        self.parameters = parameters
+        self.prefix = prefix
+
+    def __getitem__(self, index):
+        return self.parameters[0][len(self.prefix):]
+
+    def __setitem__(self, index, value):
+        self.parameters[0] = self.prefix + value
+
+
+class CommandVisitor:
+    """
+    Walks the command lists of map events, common events and troops collecting their text in a single pass
+    @param file_key : name of the file, first element of the keys
+    @param jobs : list the jobs are appended to
+    @param keys : list the keys (file, event id, page index, list index, sub index) of the jobs are appended to
+    @param neatly : collect the rows of each dialog window as a single text to print neatly
+    @param plugin_prefixes : plugin commands (356) starting with one of these prefixes have the rest of their text
+                             translated (ex: 'ShowInfo ')
+    @param codes : list the code of the command of each job is appended to, or None
+    """
+
+    def __init__(self, file_key, jobs, keys, neatly=True, plugin_prefixes=(), codes=None):
+        self.file_key = file_key
+        self.jobs = jobs
+        self.keys = keys
+        self.neatly = neatly
+        self.plugin_prefixes = tuple(plugin_prefixes)
+        self.codes = codes
+        self.commands = None
+        self.event_id = None
+        self.page = 0
+
+    def add(self, job, list_index, sub_index=0):
+        self.jobs.append(job)
+        self.keys.append((self.file_key, self.event_id, self.page, list_index, sub_index))
+        if self.codes is not None:
+            self.codes.append(self.commands[list_index]['code'])
+
+    def visit(self, commands, event_id, page=0):
+        self.commands = commands
+        self.event_id = event_id
+        self.page = page
+        i = 0
+        while i < len(commands):
+            handler = COMMAND_HANDLERS.get(commands[i].get('code'))
+            i = handler(self, commands, i) if handler is not None else i + 1
+
+    def visit_pages(self, event_id, pages):
+        for page, content in enumerate(pages):
+            self.visit(content['list'], event_id, page)
+
+
+def rows(commands, i, code):
+    """
+    @return : index of the first command after the consecutive commands with the given code starting at i
+    """
+    end = i + 1
+    while end < len(commands) and commands[end].get('code') == code:
+        end += 1
+    return end
+
+
+# Show text rows (ex: ["plain text"]), with print neatly a window is translated as a whole
+@command_handler(401)
+def show_text(visitor, commands, i):
+    if not visitor.neatly:
+        if commands[i]['parameters'][0]:
+            visitor.add((commands[i]['parameters'][0], commands[i]['parameters'], 0, None, 'Anomaly plain text: {}'), i)
+        return i + 1
+    end = rows(commands, i, 401)
+    text = ' '.join(commands[k]['parameters'][0] for k in range(i, end))
+    if text:
+        visitor.add((text, commands, i, end, None), i)
+    return end
+
+
+# Scrolling text rows (ex: ["plain text"]), translated one by one since they are not bound to a window width
+@command_handler(405)
+def scrolling_text(visitor, commands, i):
+    if commands[i]['parameters'][0]:
+        visitor.add((commands[i]['parameters'][0], commands[i]['parameters'], 0, None, 'Anomaly scrolling text: {}'), i)
+    return i + 1
+
+
+# Choices (ex: [["yes", "no"], 1, 0, 2, 0])
+@command_handler(102)
+def show_choices(visitor, commands, i):
+    choices = commands[i]['parameters'][0]
+    for j, choice in enumerate(choices or []):
+        if choice:
+            visitor.add((choice, choices, j, None, 'Anomaly choices: {}'), i, j)
+    return i + 1
+
+
+# Choices (answer) (ex: [0, "yes"])
+@command_handler(402)
+def when_choice(visitor, commands, i):
+    parameters = commands[i]['parameters']
+    if len(parameters) != 2 or not parameters[1]:
+        print('Anomaly choices (answer) - Unexpected 402 Code: {}'.format(parameters))
+        return i + 1
+    visitor.add((parameters[1], parameters, 1, None, 'Anomaly choices (answer): {}'), i)
+    return i + 1
+
+
+# Change name and change nickname (ex: [1, "Gaya"])
+@command_handler(320, 324)
+def change_name(visitor, commands, i):
+    parameters = commands[i]['parameters']
+    if len(parameters) == 2 and isinstance(parameters[1], str) and parameters[1]:
+        visitor.add((parameters[1], parameters, 1, None, 'Anomaly name: {}'), i)
+    return i + 1
+
+
+# Plugin commands (ex: ["ShowInfo Welcome to the village"]), only the ones starting with a registered prefix
+@command_handler(356)
+def plugin_command(visitor, commands, i):
+    parameters = commands[i]['parameters']
+    command = parameters[0] if parameters and isinstance(parameters[0], str) else ''
+    for prefix in visitor.plugin_prefixes:
+        if command.startswith(prefix) and command[len(prefix):].strip():
+            visitor.add((command[len(prefix):], PrefixedSlot(parameters, prefix), 0, None, 'Anomaly plugin text: {}'), i)
+            break
+    return i + 1
@@ -0,0 +1,81 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+def source_hash(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
+
+class TranslationJournal:
+    """
+    Append-only journal of the translated segments, used to resume interrupted runs in the middle of a file.
+    Each line records the translation of a segment, identified by (file, event id, page index, list index, sub index)
+    and by the hash of its source text, so segments changed since the journal was written are translated again.
+    @param path : path of the journal file (created if missing)
+    @param dst : destination language, entries written for other languages are ignored
+    @param sync_every : number of entries written before the journal is flushed and synced to disk
+    @param sync_interval : maximum number of seconds between two syncs
+    """
+
+    def __init__(self, path, dst, sync_every=50, sync_interval=5.0):
+        self.path = path
+        self.dst = dst
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.replayed = 0
+        self._entries = {}
+        self._pending = 0
+        self._last_sync = time.time()
+        self._lock = threading.Lock()
+        if os.path.isfile(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:  # last line truncated by a crash
+                        continue
+                    if entry['l'] == dst:
+                        self._entries[tuple(entry['k'])] = (entry['h'], entry['t'])
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, text):
+        """
+        @param key : (file, event id, page index, list index, sub index)
+        @param text : source text of the segment
+        @return : the journaled translation or None if the segment has not been translated yet or has changed
+        """
+        entry = self._entries.get(tuple(key))
+        if entry is None or entry[0] != source_hash(text):
+            return None
+        self.replayed += 1
+        return entry[1]
+
+    def add(self, key, text, translation):
+        key = tuple(key)
+        line = json.dumps({'l': self.dst, 'k': key, 'h': source_hash(text), 't': translation}, ensure_ascii=False)
+        with self._lock:
+            self._entries[key] = (source_hash(text), translation)
+            self._file.write(line + '\n')
+            self._pending += 1
+            if self._pending >= self.sync_every or time.time() - self._last_sync > self.sync_interval:
+                self._sync()
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._pending = 0
+        self._last_sync = time.time()
+
+    def close(self):
+        with self._lock:
+            self._sync()
+            self._file.close()
+
+    def __str__(self):
+        return 'journal {}: {} segments replayed, {} entries'.format(self.path, self.replayed, len(self._entries))
@@ -0,0 +1,133 @@
+import json
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = ' \t\n\r'
+
+
+class _Reader:
+    """
+    Reads JSON values one at a time from a text file, keeping in memory only the value being decoded
+    """
+
+    def __init__(self, f, chunk_size=1 << 16):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self, size):
+        data = self.f.read(size)
+        if not data:
+            self.eof = True
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+
+    def peek(self):
+        """
+        Skip whitespace and return the next character, or '' at the end of the file
+        """
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf) or self.eof:
+                return self.buf[self.pos:self.pos + 1]
+            self._fill(self.chunk_size)
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError('expected {} at {}'.format(char, self.buf[self.pos:self.pos + 20]))
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                obj, end = _decoder.raw_decode(self.buf, self.pos)
+                # a value ending exactly at the end of the buffer may be truncated (ex: numbers)
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return obj
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            # grow geometrically so that huge values are decoded in linear time
+            self._fill(max(self.chunk_size, len(self.buf)))
+
+    def array(self):
+        """
+        Iterate over the elements of the array starting at the current position
+        """
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.peek() == ',':
+                self.pos += 1
+            else:
+                self.expect(']')
+                return
+
+
+def _dumps(value, indent, level):
+    text = json.dumps(value, indent=indent, ensure_ascii=False)
+    if indent is None:
+        return text
+    # JSON strings never contain raw newlines, so each line can be indented safely
+    return text.replace('\n', '\n' + ' ' * indent * level)
+
+
+def _write_array(out, items, indent, level):
+    first = True
+    for item in items:
+        if first:
+            out.write('[')
+            first = False
+        else:
+            out.write(',' if indent is not None else ', ')
+        if indent is not None:
+            out.write('\n' + ' ' * indent * (level + 1))
+        out.write(_dumps(item, indent, level + 1))
+    if first:
+        out.write('[]')
+        return
+    if indent is not None:
+        out.write('\n' + ' ' * indent * level)
+    out.write(']')
+
+
+def stream_json_array(in_path, out_path, transform, array_key='events', indent=4):
+    """
+    Copy the JSON file in_path to out_path passing the elements of its main array through transform, without loading
+    the whole file. The main array is the file itself if it is an array, otherwise the value of array_key.
+    The output is identical to json.dump(data, f, indent=indent, ensure_ascii=False).
+    @param transform : function taking an iterator over the elements and returning an iterator over the new elements
+    """
+    with open(in_path, 'r', encoding='utf-8-sig') as f_in, open(out_path, 'w', encoding='utf-8') as out:
+        reader = _Reader(f_in)
+        if reader.peek() == '[':
+            _write_array(out, transform(reader.array()), indent, 0)
+            return
+        reader.expect('{')
+        first = True
+        out.write('{')
+        while reader.peek() != '}':
+            if not first:
+                reader.expect(',')
+                out.write(',' if indent is not None else ', ')
+            key = reader.value()
+            reader.expect(':')
+            if indent is not None:
+                out.write('\n' + ' ' * indent)
+            out.write(json.dumps(key, ensure_ascii=False) + ': ')
+            if key == array_key and reader.peek() == '[':
+                _write_array(out, transform(reader.array()), indent, 1)
+            else:
+                out.write(_dumps(reader.value(), indent, 1))
+            first = False
+        reader.expect('}')
+        if indent is not None and not first:
+            out.write('\n')
+        out.write('}')
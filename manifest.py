@@ -0,0 +1,124 @@
+import json
+import os
+import threading
+
+from journal import source_hash
+from segment_store import SegmentStore, StringTable
+
+
+class TranslationManifest:
+    """
+    Records, for each translated segment of each file, the hash of its source text and the strings written in the
+    translated file, so that an updated version of the game can be translated again sending only new or changed text.
+    Segments are identified by (file, event id, page index, list index, sub index) like in the journal. They are kept
+    in a SegmentStore per file sharing a single StringTable, so a manifest of thousands of maps stays small in memory.
+    Each saved file is appended to a log next to the manifest, the log is merged into the manifest by close and
+    replayed when a run stopped before closing it.
+    @param path : path of the JSON manifest (created if missing)
+    @param dst : destination language
+    """
+
+    def __init__(self, path, dst):
+        self.path = path
+        self.log_path = path + '.log'
+        self.dst = dst
+        self.reused = 0
+        self.strings = StringTable()
+        self._files = {}
+        # files of a manifest written before the segment stores
+        self._legacy = {}
+        self._new = {}
+        self._log = None
+        self._lock = threading.Lock()
+        self._log_lock = threading.Lock()
+        if os.path.isfile(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest['dst'] == dst:
+                if 'strings' in manifest:
+                    for file_key, content in manifest['files'].items():
+                        self._files[file_key] = SegmentStore.from_dict(content, manifest['strings'], self.strings)
+                    self._legacy = manifest.get('legacy_files', {})
+                else:
+                    self._legacy = manifest['files']
+        if os.path.isfile(self.log_path):
+            with open(self.log_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:  # last line truncated by a crash
+                        continue
+                    if entry['l'] == dst:
+                        self._files[entry['f']] = SegmentStore.from_dict(entry['s'], entry['strings'], self.strings)
+                        self._legacy.pop(entry['f'], None)
+
+    def get(self, key, text):
+        """
+        @param key : (file, event id, page index, list index, sub index)
+        @param text : current source text of the segment
+        @return : the strings written for the segment in the previous run, or None if the segment is new or changed
+        """
+        store = self._files.get(key[0])
+        if store is not None:
+            r = store.find(*key[1:])
+            if r is None or not store.matches(r, text):
+                return None
+            outputs = store.outputs_of(r)
+        else:
+            entry = self._legacy.get(key[0], {}).get('/'.join(str(k) for k in key[1:]))
+            if entry is None or entry[0] != source_hash(text):
+                return None
+            outputs = entry[1]
+        self.reused += 1
+        return outputs
+
+    def add(self, key, text, outputs, code=None):
+        """
+        @param code : code of the event command of the segment (ex: 401)
+        """
+        with self._lock:
+            store = self._new.get(key[0])
+            if store is None:
+                store = self._new[key[0]] = SegmentStore(self.strings)
+            store.add(*key[1:], text, outputs, code)
+
+    def save(self, file_key):
+        """
+        Replace the entries of file_key with the ones added since the last save and append them to the log,
+        in a time proportional to the size of the file
+        """
+        with self._lock:
+            store = self._files[file_key] = self._new.pop(file_key, None) or SegmentStore(self.strings)
+            self._legacy.pop(file_key, None)
+        table = StringTable()
+        content = store.to_dict(table)
+        line = json.dumps({'l': self.dst, 'f': file_key, 'strings': list(table), 's': content}, ensure_ascii=False)
+        with self._log_lock:
+            if self._log is None:
+                self._log = open(self.log_path, 'a', encoding='utf-8')
+            self._log.write(line + '\n')
+            self._log.flush()
+            os.fsync(self._log.fileno())
+
+    def close(self):
+        """
+        Write the manifest with all the saved files and remove the log
+        """
+        with self._log_lock:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+            if not os.path.isfile(self.log_path):
+                return
+            # only the strings still used are saved
+            table = StringTable()
+            files = {file: store.to_dict(table) for file, store in self._files.items()}
+            part_path = self.path + '.part'
+            with open(part_path, 'w', encoding='utf-8') as f:
+                json.dump({'dst': self.dst, 'strings': list(table), 'files': files, 'legacy_files': self._legacy}, f,
+                          ensure_ascii=False)
+            os.replace(part_path, self.path)
+            os.remove(self.log_path)
+
+    def __str__(self):
+        return 'manifest {}: {} segments reused'.format(self.path, self.reused)
@@ -0,0 +1,35 @@
+import re
+
+from print_neatly import CONTROL_CODES
+
+PLACEHOLDER = re.compile(r'\{(\d+)\}')
+
+
+def mask_codes(text):
+    """
+    Replace the control codes of text (ex: \\N[1], \\V[12], \\C[3], \\!) with numbered placeholders {0}, {1}, ...
+    so that the translator does not corrupt them and lines differing only by their codes share the same template
+    @return : (template, codes), template is text itself with no codes when text already contains a placeholder
+    """
+    if PLACEHOLDER.search(text):
+        return text, []
+    codes = []
+
+    def placeholder(match):
+        codes.append(match.group())
+        return '{' + str(len(codes) - 1) + '}'
+
+    return CONTROL_CODES.sub(placeholder, text), codes
+
+
+def unmask_codes(translation, codes):
+    """
+    Put back in the translation of a template the codes removed by mask_codes
+    @return : the translation with its control codes, or None if the translator lost or duplicated a placeholder
+    """
+    if not codes:
+        return translation
+    found = PLACEHOLDER.findall(translation)
+    if sorted(int(n) for n in found) != list(range(len(codes))):
+        return None
+    return PLACEHOLDER.sub(lambda match: codes[int(match.group(1))], translation)
@@ -0,0 +1,199 @@
+import collections
+import contextlib
+import json
+import sys
+import threading
+import time
+
+# upper bounds (in seconds) of the buckets of the latency histograms
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float('inf'))
+
+
+class Histogram:
+    """
+    Distribution of durations over fixed buckets, cheap enough to be updated on every call
+    """
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+
+    def add(self, seconds):
+        for b, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.counts[b] += 1
+                break
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        """
+        @return : upper bound of the bucket containing the quantile q
+        """
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= q * self.count:
+                return bound if bound != float('inf') else self.max
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'total_seconds': round(self.total, 6),
+            'mean_seconds': round(self.total / self.count, 6) if self.count else None,
+            'min_seconds': round(self.min, 6) if self.count else None,
+            'max_seconds': round(self.max, 6),
+            'p50_seconds': self.quantile(0.5) if self.count else None,
+            'p90_seconds': self.quantile(0.9) if self.count else None,
+            'p99_seconds': self.quantile(0.99) if self.count else None,
+            'buckets': {'<={}'.format(bound): count for bound, count in zip(BUCKETS, self.counts) if count},
+        }
+
+
+class Metrics:
+    """
+    Counters, latency histograms and per file throughput of a run, shared by all the workers.
+    Progress is printed at most every progress_interval seconds instead of once per event.
+    @param progress_interval : seconds between two progress lines, 0 to never print them
+    """
+
+    def __init__(self, progress_interval=5.0):
+        self.progress_interval = progress_interval
+        self.counters = collections.Counter()
+        self.histograms = collections.defaultdict(Histogram)
+        self.files = {}
+        self.start = time.perf_counter()
+        self._last_progress = self.start
+        self._lock = threading.Lock()
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def observe(self, name, seconds):
+        with self._lock:
+            self.histograms[name].add(seconds)
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def segments_done(self, n):
+        """
+        Count n translated segments and print the progress if progress_interval seconds passed since the last time
+        """
+        with self._lock:
+            self.counters['segments'] += n
+            now = time.perf_counter()
+            if self.progress_interval <= 0 or now - self._last_progress < self.progress_interval:
+                return
+            self._last_progress = now
+            segments = self.counters['segments']
+        print('{} segments translated ({:.1f}/s)'.format(segments, segments / (now - self.start)))
+
+    def file_done(self, file, segments, seconds):
+        with self._lock:
+            self.files[file] = {'segments': segments, 'seconds': round(seconds, 3),
+                                'segments_per_second': round(segments / seconds, 1) if seconds > 0 else None}
+
+    def to_dict(self, **extra):
+        with self._lock:
+            metrics = {
+                'seconds': round(time.perf_counter() - self.start, 3),
+                'counters': dict(self.counters),
+                'histograms': {name: histogram.to_dict() for name, histogram in sorted(self.histograms.items())},
+                'files': dict(sorted(self.files.items())),
+            }
+        metrics.update(extra)
+        return metrics
+
+    def save(self, path, **extra):
+        """
+        Write the metrics to a JSON file
+        @param extra : further sections of the file (ex: rate control or profile)
+        """
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(**extra), f, indent=4, ensure_ascii=False)
+
+    def __str__(self):
+        lines = ['metrics: {} segments in {:.1f} seconds'.format(
+            self.counters['segments'], time.perf_counter() - self.start)]
+        for name, histogram in sorted(self.histograms.items()):
+            lines.append('  {}: {} calls, {:.3f} s total, p50 {} s, p99 {} s'.format(
+                name, histogram.count, histogram.total, histogram.quantile(0.5), histogram.quantile(0.99)))
+        return '\n'.join(lines)
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of all the threads every interval seconds from a background thread, so the run is slowed down
+    far less than with cProfile and the time spent waiting for the network is visible too.
+    Usage: with SamplingProfiler() as profiler: ...
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = 0
+        self.own = collections.Counter()
+        self.cumulative = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def _name(frame):
+        code = frame.f_code
+        return '{}:{}:{}'.format(code.co_filename, code.co_firstlineno, code.co_name)
+
+    def _sample(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me:
+                    continue
+                self.samples += 1
+                self.own[self._name(frame)] += 1
+                seen = set()
+                while frame is not None:
+                    name = self._name(frame)
+                    if name not in seen:  # recursive functions are counted once per sample
+                        seen.add(name)
+                        self.cumulative[name] += 1
+                    frame = frame.f_back
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def to_dict(self, top=30):
+        def rows(counter):
+            return [{'function': name, 'samples': n, 'fraction': round(n / self.samples, 4)}
+                    for name, n in counter.most_common(top)]
+        return {'interval': self.interval, 'samples': self.samples,
+                'own': rows(self.own), 'cumulative': rows(self.cumulative)}
+
+    def __str__(self):
+        lines = ['profile: {} samples, functions with the most samples on top of the stack:'.format(self.samples)]
+        for name, n in self.own.most_common(15):
+            lines.append('  {:6.1%}  {}'.format(n / max(1, self.samples), name))
+        return '\n'.join(lines)
+
+
+def add_metrics_arguments(ap):
+    ap.add_argument("-mo", "--metrics_out", "--metrics-out", type=str, default=None)
+    ap.add_argument("-pr", "--profile", action="store_true", default=False)
+    ap.add_argument("-pi", "--progress_interval", type=float, default=5.0)
@@ -0,0 +1,162 @@
+# Strings to translate of each database file, declared as paths compiled once into extractors.
+# A path is a list of steps separated by dots:
+#   - a key of an object (ex: 'terms.messages')
+#   - '*' every element of an array or every value of an object
+#   - '[*]' every element of an array
+#   - '**' the node itself and all the arrays and objects nested in it, at any depth
+# The last step selects the strings: only non empty strings are translated.
+import os
+
+from event_commands import CommandVisitor
+
+
+def _children(node):
+    if isinstance(node, dict):
+        return node.values()
+    if isinstance(node, list):
+        return node
+    return ()
+
+
+def _descendants(node):
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, (dict, list)):
+            yield node
+            stack.extend(reversed(list(_children(node))))
+
+
+def _keys(node, step):
+    if step == '*' and isinstance(node, dict):
+        return node.keys()
+    if step in ('*', '[*]') and isinstance(node, list):
+        return range(len(node))
+    if isinstance(node, dict) and step in node:
+        return (step,)
+    return ()
+
+
+def compile_nodes(path):
+    """
+    @return : function taking the content of a file and returning the list of the nodes selected by path
+    """
+    selects = []
+    for step in path.split('.') if path else ():
+        if step == '**':
+            selects.append(lambda nodes: [d for node in nodes for d in _descendants(node)])
+        else:
+            selects.append(lambda nodes, step=step: [node[key] for node in nodes for key in _keys(node, step)])
+
+    def nodes_of(data):
+        nodes = [data]
+        for select in selects:
+            nodes = select(nodes)
+        return nodes
+    return nodes_of
+
+
+def compile_path(path):
+    """
+    @return : function taking the content of a file and returning the list of (container, key) of the non empty
+              strings selected by path
+    """
+    parent, _, last = path.rpartition('.')
+    nodes_of = compile_nodes(parent)
+
+    def extract(data):
+        return [(node, key) for node in nodes_of(data) for key in _keys(node, last)
+                if isinstance(node[key], str) and node[key]]
+    return extract
+
+
+class Field:
+    """
+    Strings of a database file sharing the same handling
+    @param path : path of the strings (see above)
+    @param neatly : reflow the translation on two rows of max_len characters (ex: descriptions)
+    @param remove_escape : translate the text with its line breaks replaced by spaces
+    @param keep_space : keep the leading space of the original text
+    """
+    __slots__ = ('path', 'neatly', 'remove_escape', 'keep_space', 'extract')
+
+    def __init__(self, path, neatly=False, remove_escape=True, keep_space=True):
+        self.path = path
+        self.neatly = neatly
+        self.remove_escape = remove_escape
+        self.keep_space = keep_space
+        self.extract = compile_path(path)
+
+    def collect(self, data, jobs):
+        for container, key in self.extract(data):
+            text = container[key].replace('\n', ' ') if self.remove_escape else container[key]
+            jobs.append((container, key, text, self.neatly, self.keep_space))
+
+
+class Commands:
+    """
+    Event command lists of a database file (ex: the pages of the troops), each text row is translated on its own
+    @param path : path of the objects having an id and a command list (see above)
+    @param lists : key of the command list in these objects, or of their pages when pages is True
+    """
+    __slots__ = ('path', 'lists', 'pages', 'extract')
+
+    def __init__(self, path, lists='list', pages=False):
+        self.path = path
+        self.lists = lists
+        self.pages = pages
+        self.extract = compile_nodes(path)
+
+    def collect(self, data, jobs):
+        events_jobs = []
+        visitor = CommandVisitor(None, events_jobs, [], neatly=False)
+        for event in self.extract(data):
+            if not isinstance(event, dict) or self.lists not in event:
+                continue
+            if self.pages:
+                visitor.visit_pages(event['id'], event[self.lists])
+            else:
+                visitor.visit(event[self.lists], event['id'])
+        jobs.extend((target, j, text, False, True) for text, target, j, _, _ in events_jobs)
+
+
+# fields of the records of the databases without a schema of their own (Armors, Weapons, Items, Skills, ...)
+RECORDS = [
+    Field('*.name'),
+    Field('*.description', neatly=True),
+    Field('*.profile', neatly=True),
+    # messages start with a space when they follow the name of the battler (ex: " is poisoned!")
+    Field('*.message1', remove_escape=False),
+    Field('*.message2', remove_escape=False),
+    Field('*.message3', remove_escape=False),
+    Field('*.message4', remove_escape=False),
+]
+
+SCHEMAS = {
+    'Actors.json': RECORDS + [Field('*.nickname')],
+    'Troops.json': [Commands('*', 'pages', pages=True)],
+    'System.json': [
+        Field('gameTitle'),
+        Field('currencyUnit'),
+        Field('terms.basic.*'),
+        Field('terms.commands.*'),
+        Field('terms.params.*'),
+        # messages contain the %1, %2 of the values shown
+        Field('terms.messages.*', remove_escape=False),
+        Field('elementTypes.*'),
+        Field('skillTypes.*'),
+        Field('weaponTypes.*'),
+        Field('armorTypes.*'),
+        Field('equipTypes.*'),
+    ],
+    # databases of plugins
+    'GalleryList.json': [Field('**.' + key) for key in ('displayName', 'hint', 'stageText', 'sceneText', 'text')],
+    'RubiList.json': [Field('**.[*]')],
+}
+
+
+def schema_of(file_path):
+    """
+    @return : list of the fields of the database file
+    """
+    return SCHEMAS.get(os.path.basename(file_path), RECORDS)
@@ -1,116 +1,150 @@
 import argparse
+import contextlib
 import json
 import os
+import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
-from googletrans import Translator  # pip install googletrans==4.0.0rc1
-
+from backends import add_backend_arguments, backend_from_args
+from dry_run import DryRun, latency_from_metrics
+from metrics import Metrics, SamplingProfiler, add_metrics_arguments
+from object_schemas import schema_of
+from pipeline import run_pipeline
 from print_neatly import print_neatly
+from rate_limiter import add_rate_arguments, rate_controller_from_args
+from span_writer import SpanDocument
+from targets import parse_targets
+from translation_cache import TranslationCache
+from translation_engine import TranslationEngine
 
 
-def translate(file_path, tr, src='it', dst='en', verbose=False, max_retries=5, max_len=55):
+def collect_objects(data, file_path, codes=None):
+    """
+    Collect the strings to translate of an object database, as declared by the schema of the file in object_schemas
+    @param data : content of the file
+    @param codes : list the path of the field of each job is appended to, or None
+    @return : list of jobs (container, key, text, neatly, keep_space)
+    """
+    jobs = []
+    for field in schema_of(file_path):
+        collected = len(jobs)
+        field.collect(data, jobs)
+        if codes is not None:
+            codes.extend([field.path] * (len(jobs) - collected))
+    return jobs
 
-    def translate_sentence(text):
-        target = text
-        translation = tr.translate(target, src=src, dest=dst).text
-        if target[0].isalpha() and translation[0].isalpha and not target[0].isupper():
-            translation = translation[0].lower() + translation[1:]
-        text = translation
-        if verbose:
-            print(target, '->', translation)
-        return text
 
-    def translate_and_check(text, remove_escape=True, neatly=False, keep_space=True):
-        text_tr = None
-        if remove_escape:
-            text = text.replace('\n', ' ')
+def check(text, text_tr, max_len=55, neatly=False, keep_space=True, metrics=None):
+    if neatly:
         try:
-            text_tr = translate_sentence(text)
-        except:
-            for _ in range(max_retries):
-                try:
-                    time.sleep(1)
-                    text_tr = translate_sentence(text)
-                except:
-                    pass
-                if text_tr is not None:
-                    break
-        if text_tr is None:
-            print('Anomaly: {}'.format(text))
-            return None, 0
-        if neatly:
-            try:
+            if metrics is not None:
+                with metrics.timer('print_neatly'):
+                    text_neat = print_neatly(text_tr, max_len)
+            else:
                 text_neat = print_neatly(text_tr, max_len)
-                if len(text_neat) > 1:
-                    text_tr = text_neat[0] + '\n' + text_neat[1]
-                else:
-                    text_tr = text_neat[0]
-            except:
-                pass
-        if keep_space:
-            if text[0] == ' ' and text_tr[0] != ' ':
-                text_tr = ' ' + text_tr
-        return text_tr, 1
-
-    def translate_based_on_keys(dict_or_list, keys, translations=0, remove_escape=True, neatly=False, array_translate=False):
-        if isinstance(dict_or_list, dict):
-            for d in dict_or_list:
-                if isinstance(dict_or_list[d], dict) or isinstance(dict_or_list[d], list):
-                    translations += translate_based_on_keys(dict_or_list[d], keys, translations, remove_escape, neatly, array_translate)
-                elif d in keys and len(dict_or_list[d]) > 0:
-                    tr, success = translate_and_check(dict_or_list[d], remove_escape, neatly)
-                    dict_or_list[d] = tr
-                    translations += success
-        elif isinstance(dict_or_list, list):
-            for i in range(len(dict_or_list)):
-                if isinstance(dict_or_list[i], dict) or isinstance(dict_or_list[i], list):
-                    translations += translate_based_on_keys(dict_or_list[i], keys, translations, remove_escape, neatly, array_translate)
-                elif array_translate and isinstance(dict_or_list[i], str) and len(dict_or_list[i]) > 0:
-                    tr, success = translate_and_check(dict_or_list[i], remove_escape, neatly)
-                    dict_or_list[i] = tr
-                    translations += success
-        return translations
+            if len(text_neat) > 1:
+                text_tr = text_neat[0] + '\n' + text_neat[1]
+            else:
+                text_tr = text_neat[0]
+        except:
+            pass
+    if keep_space:
+        if text[0] == ' ' and text_tr[0] != ' ':
+            text_tr = ' ' + text_tr
+    return text_tr
+
 
+def apply_objects(jobs, results, max_len=55, verbose=False, metrics=None):
+    """
+    Write back the translations of the collected jobs
+    @param metrics : Metrics or None, records the time spent in print_neatly
+    @return : number of strings translated
+    """
     translations = 0
+    for (container, key, text, neatly, keep_space), (text_tr, success) in zip(jobs, results):
+        if not success:
+            print('Anomaly: {}'.format(text))
+            continue
+        if verbose:
+            print(text, '->', text_tr)
+        container[key] = check(text, text_tr, max_len, neatly, keep_space, metrics)
+        translations += 1
+    return translations
+
+
+def translate(file_path, tr, src='it', dst='en', verbose=False, max_retries=5, max_len=55, cache=None, engine=None,
+              data=None):
+    if engine is None:
+        engine = TranslationEngine(tr, src, dst, max_retries=max_retries, cache=cache)
+    # data is given when the file has already been loaded (ex: by a SpanDocument)
+    if data is None:
+        with open(file_path, 'r', encoding='utf-8-sig') as datafile, engine.metrics.timer('json_load'):
+            data = json.load(datafile)
+    jobs = collect_objects(data, file_path)
+    results = engine.translate_all([job[2] for job in jobs])
+    return data, apply_objects(jobs, results, max_len, verbose, engine.metrics)
+
+
+def translate_targets(file_path, data, engines, write, max_lens, verbose=False):
+    """
+    Translate an object database in several languages collecting its strings only once.
+    The translations run concurrently, then the translations of each language are applied and written in turn and the
+    database is restored to its original text before the next language.
+    @param engines : dict of the TranslationEngine of each destination language
+    @param write : function called with the language once its translations are applied, it writes the translated file
+    @param max_lens : dict of the length of the descriptions of each language
+    @return : dict of the number of strings translated in each language
+    """
+    jobs = collect_objects(data, file_path)
+    texts = [job[2] for job in jobs]
+    originals = [container[key] for container, key, _, _, _ in jobs]
+    translations = {}
+    with ThreadPoolExecutor(max_workers=len(engines)) as languages_pool:
+        futures = {lang: languages_pool.submit(engine.translate_all, texts) for lang, engine in engines.items()}
+        for lang, future in futures.items():
+            translations[lang] = apply_objects(jobs, future.result(), max_lens[lang], verbose, engines[lang].metrics)
+            write(lang)
+            for (container, key, _, _, _), value in zip(jobs, originals):
+                container[key] = value
+    return translations
+
+
+def extract_file(file_path):
+    """
+    First stage of the pipeline: load an object database and collect its strings
+    @return : (texts, keys)
+    """
     with open(file_path, 'r', encoding='utf-8-sig') as datafile:
-        data = json.load(datafile)
-    num_ids = len([e for e in data if e is not None])
-    i = 0
+        jobs = collect_objects(json.load(datafile), file_path)
+    return [job[2] for job in jobs], None
 
-    if file_path.endswith('GalleryList.json'):
-        translations += translate_based_on_keys(data, ['displayName', 'hint', 'stageText', 'sceneText', 'text'], translations)
-    
-    elif file_path.endswith('RubiList.json'):
-        translations += translate_based_on_keys(data, [], translations, array_translate=True)
 
+def write_file(file_path, new_file, max_len, verbose, indent, keep_format, results):
+    """
+    Last stage of the pipeline: load the database again, apply the results of the translation of the strings returned
+    by extract_file and write the translated file
+    @param keep_format : replace only the translated strings in a copy of the original file
+    @return : number of strings translated
+    """
+    document = SpanDocument(file_path) if keep_format else None
+    if document is not None:
+        data = document.data
+    else:
+        with open(file_path, 'r', encoding='utf-8-sig') as datafile:
+            data = json.load(datafile)
+    translations = apply_objects(collect_objects(data, file_path), results, max_len, verbose)
+    if document is not None:
+        document.save(new_file)
     else:
-        for d in data:
-            if d is not None:
-                print('{}: {}/{}'.format(file_path, i+1, num_ids))
-                i += 1
-                if 'name' in d.keys() and len(d['name']) > 0:
-                    name_tr, success = translate_and_check(d['name'], remove_escape=True, neatly=False)
-                    d['name'] = name_tr
-                    translations += success
-                if 'description' in d.keys() and len(d['description']) > 0:
-                    desc_tr, success = translate_and_check(d['description'], remove_escape=True, neatly=True)
-                    d['description'] = desc_tr
-                    translations += success
-                if 'profile' in d.keys() and len(d['profile']) > 0:
-                    prf_tr, success = translate_and_check(d['profile'], remove_escape=True, neatly=True)
-                    d['profile'] = prf_tr
-                    translations += success
-                for m in range(1, 5):
-                    message = 'message' + str(m)
-                    if message in d.keys() and len(d[message]) > 0:
-                        message_tr, success = translate_and_check(d[message], remove_escape=False, neatly=False)
-                        d[message] = message_tr
-                        translations += success
-
-    return data, translations
+        with open(new_file, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=indent, ensure_ascii=False)
+    return translations
 
 
 # usage: python objects_translator.py --source_lang it --dest_lang en
+#        python objects_translator.py --source_lang it --dest_lang en,fr,de --max_len 55,de:60
 if __name__ == '__main__':
     ap = argparse.ArgumentParser()
     ap.add_argument("-i", "--input_folder", type=str, default="objects")
@@ -118,28 +152,138 @@ if __name__ == '__main__':
     ap.add_argument("-dl", "--dest_lang", type=str, default="en")
     ap.add_argument("-v", "--verbose", action="store_true", default=False)
     ap.add_argument("-nf", "--no_format", action="store_true", default=False)
-    ap.add_argument("-ml", "--max_len", type=int, default=55)
+    ap.add_argument("-kf", "--keep_format", action="store_true", default=False)
+    ap.add_argument("-ml", "--max_len", type=str, default="55")
     ap.add_argument("-mr", "--max_retries", type=int, default=10)
+    ap.add_argument("-c", "--cache", type=str, default=None)
+    ap.add_argument("-cs", "--cache_size", type=int, default=100000)
+    ap.add_argument("-w", "--workers", type=int, default=1)
+    ap.add_argument("-pc", "--pack_chars", type=int, default=0)
+    ap.add_argument("-nm", "--no_mask", action="store_true", default=False)
+    ap.add_argument("-pp", "--processes", type=int, default=0)
+    ap.add_argument("-if", "--in_flight", type=int, default=0)
+    ap.add_argument("-dr", "--dry_run", "--dry-run", action="store_true", default=False)
+    ap.add_argument("-ef", "--eta_from", type=str, default=None)
+    add_backend_arguments(ap)
+    add_rate_arguments(ap)
+    add_metrics_arguments(ap)
     args = ap.parse_args()
-    dest_folder = args.input_folder + '_' + args.dest_lang
-    translations = 0
-    if not os.path.exists(dest_folder):
-        os.makedirs(dest_folder)
+    try:
+        # max_len of each destination language
+        targets = parse_targets(args.dest_lang, args.max_len)
+    except ValueError as e:
+        ap.error(str(e))
+    if len(targets) > 1 and args.processes > 0:
+        ap.error('several --dest_lang cannot be used with --processes')
+    metrics = Metrics(args.progress_interval)
+    cache = TranslationCache(args.cache, max_entries=args.cache_size) if args.cache else None
+    # a single backend (and its pool of clients) is shared by all the files
+    backend = backend_from_args(args)
+    # the rate control is shared too, so throttling seen by a file slows down all the others
+    rate_control = rate_controller_from_args(args)
+    # one engine by language, all sharing the backend, the cache, the rate control and the metrics
+    # the engines share the slots of the requests too, so there are at most `workers` requests in flight in total
+    slots = threading.Semaphore(args.workers)
+    engines = {lang: TranslationEngine(backend, args.source_lang, lang, max_retries=args.max_retries, cache=cache,
+                                       workers=args.workers, pack_chars=args.pack_chars, rate_control=rate_control,
+                                       retry_rounds=args.retry_rounds, metrics=metrics, mask=not args.no_mask,
+                                       slots=slots)
+               for lang in targets}
+    # the pipeline uses the first language
+    dest_lang, max_len = next(iter(targets.items()))
+    engine = engines[dest_lang]
+    dest_folders = {lang: args.input_folder + '_' + lang for lang in targets}
+    dest_folder = dest_folders[dest_lang]
+    for folder in dest_folders.values():
+        if not args.dry_run and not os.path.exists(folder):
+            os.makedirs(folder)
+
+    def translate_file(file):
+        file_path = os.path.join(args.input_folder, file)
+        print('translating file: {}'.format(file_path))
+        # the languages the file has not been translated in yet
+        langs = [lang for lang in targets if not os.path.isfile(os.path.join(dest_folders[lang], file))]
+        document = None
+        if args.keep_format:
+            with metrics.timer('json_load'):
+                document = SpanDocument(file_path)
+            data = document.data
+        else:
+            with open(file_path, 'r', encoding='utf-8-sig') as datafile, metrics.timer('json_load'):
+                data = json.load(datafile)
+
+        def write(lang):
+            new_file = os.path.join(dest_folders[lang], file)
+            with metrics.timer('json_dump'):
+                if document is not None:
+                    document.save(new_file)
+                else:
+                    with open(new_file, 'w', encoding='utf-8') as f:
+                        if not args.no_format:
+                            json.dump(data, f, indent=4, ensure_ascii=False)
+                        else:
+                            json.dump(data, f, ensure_ascii=False)
+
+        translations = translate_targets(file_path, data, {lang: engines[lang] for lang in langs}, write, targets,
+                                         args.verbose)
+        return sum(translations.values())
+
+    def measure_file(file):
+        start = time.perf_counter()
+        t = translate_file(file)
+        metrics.file_done(file, t, time.perf_counter() - start)
+        print('translated file: {} ({} strings)'.format(os.path.join(args.input_folder, file), t))
+        return t
+
+    files = []
     for file in os.listdir(args.input_folder):
         file_path = os.path.join(args.input_folder, file)
-        if os.path.isfile(os.path.join(dest_folder, file)):
+        if all(os.path.isfile(os.path.join(folder, file)) for folder in dest_folders.values()):
             print('skipped file {} because it has already been translated'.format(file_path))
             continue
         if file.endswith('.json'):
-            print('translating file: {}'.format(file_path))
-            new_data, t = translate(file_path, tr=Translator(), max_len=args.max_len,
-                                    src=args.source_lang, dst=args.dest_lang, verbose=args.verbose,
-                                    max_retries=args.max_retries)
-            translations += t
-            new_file = os.path.join(dest_folder, file)
-            with open(new_file, 'w', encoding='utf-8') as f:
-                if not args.no_format:
-                    json.dump(new_data, f, indent=4, ensure_ascii=False)
-                else:
-                    json.dump(new_data, f, ensure_ascii=False)
+            files.append(file)
+    if args.dry_run:
+        # the files are only collected, nothing is sent nor written
+        dry_runs = {lang: DryRun(engines[lang]) for lang in targets}
+        for file in files:
+            file_path = os.path.join(args.input_folder, file)
+            codes = []
+            with open(file_path, 'r', encoding='utf-8-sig') as datafile:
+                jobs = collect_objects(json.load(datafile), file_path, codes)
+            for dry_run in dry_runs.values():
+                dry_run.add_file(file, [job[2] for job in jobs], codes)
+        for lang, dry_run in dry_runs.items():
+            if len(targets) > 1:
+                print('\n{}:'.format(lang))
+            print(dry_run.report(args.eta_from and latency_from_metrics(args.eta_from), args.rate))
+        for engine in engines.values():
+            engine.close()
+        if cache is not None:
+            cache.close()
+        sys.exit()
+    # several files are translated at the same time, the engine bounds the number of requests in flight
+    with SamplingProfiler() if args.profile else contextlib.nullcontext() as profiler:
+        if args.processes > 0:
+            # parsing, reflow and serialization in other processes, only the translation in this one
+            tasks = [(os.path.join(args.input_folder, file), extract_file, (os.path.join(args.input_folder, file),),
+                      write_file, (os.path.join(args.input_folder, file), os.path.join(dest_folder, file),
+                                   max_len, args.verbose, None if args.no_format else 4, args.keep_format))
+                     for file in files]
+            translations = run_pipeline(tasks, engine, args.processes, args.in_flight)
+        else:
+            with ThreadPoolExecutor(max_workers=args.workers) as files_pool:
+                translations = sum(files_pool.map(measure_file, files))
+    for engine in engines.values():
+        engine.close()
+    backend.close()
+    print(rate_control)
+    print(metrics)
+    if profiler is not None:
+        print(profiler)
+    if args.metrics_out:
+        metrics.save(args.metrics_out, rate_control=rate_control.to_dict(), profile=profiler and profiler.to_dict())
+    if cache is not None:
+        cache.close()
+        print(cache)
     print('\ndone! translated in total {} strings'.format(translations))
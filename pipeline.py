@@ -0,0 +1,41 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+def run_pipeline(tasks, engine, processes, in_flight=0, journal=None):
+    """
+    Translate files overlapping their CPU bound stages with the network. Parsing and extraction (first stage), and
+    reflow and serialization (last stage) of each file run in a pool of processes, while the sentences extracted from
+    the files are translated by the engine in this process, so that several files are in flight at the same time.
+    @param tasks : list of (file_path, extract, extract_args, write, write_args) where extract(*extract_args) returns
+                   (texts, keys) or None when the file has nothing to translate, and write(*write_args, results)
+                   applies the results of engine.translate_all, writes the translated file and returns the number
+                   of strings translated. Both functions must be picklable (defined at module level).
+    @param engine : TranslationEngine, its metrics record the time spent waiting for each stage
+    @param processes : number of processes of the CPU bound stages
+    @param in_flight : maximum number of files between the first and the last stage, by default twice processes,
+                       it bounds the memory used by the results waiting to be written
+    @return : total number of strings translated
+    """
+    metrics = engine.metrics
+
+    def run(task):
+        file_path, extract, extract_args, write, write_args = task
+        print('translating file: {}'.format(file_path))
+        start = time.perf_counter()
+        with metrics.timer('extract_stage'):
+            collected = processes_pool.submit(extract, *extract_args).result()
+        if collected is None:
+            return 0
+        texts, keys = collected
+        results = engine.translate_all(texts, keys, journal)
+        with metrics.timer('write_stage'):
+            t = processes_pool.submit(write, *write_args, results).result()
+        metrics.file_done(os.path.basename(file_path), t, time.perf_counter() - start)
+        print('translated file: {} ({} strings)'.format(file_path, t))
+        return t
+
+    with ProcessPoolExecutor(max_workers=processes) as processes_pool:
+        with ThreadPoolExecutor(max_workers=in_flight or 2 * processes) as files_pool:
+            return sum(files_pool.map(run, tasks))
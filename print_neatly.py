@@ -1,56 +1,97 @@
-import math
+import re
+import unicodedata
 
+# RPG Maker escape codes, they are not displayed so they take no space in the dialog window
+# (ex: \C[2], \N[1], \V[12], \I[45], \FS[24], \n<Name>, \!, \., \|, \>, \<, \^, \{, \}, \$)
+CONTROL_CODES = re.compile(r'\\[A-Za-z]+\[[^\]]*\]|\\[A-Za-z]+<[^>]*>|\\[.|!><^{}$\\]')
 
-def print_neatly_optimizer(words, n, M):
+
+def display_width(text):
+    """
+    Number of columns taken by text in a dialog window: control codes take no space and
+    full-width characters (ex: CJK) take two columns
+    """
+    if '\\' in text:
+        text = CONTROL_CODES.sub('', text)
+    if text.isascii():
+        return len(text)
+    return sum(2 if unicodedata.east_asian_width(c) in 'WF' else 1 for c in text)
+
+
+def print_neatly_optimizer(words, n, M, widths=None):
     """
     Function prints a paragraph neatly
-    @param words : an array of words
+    @param words : an array of words, words[0] is a placeholder and is never used
     @param n : number of words in the array
     @param M : maximum line length
+    @param widths : display width of each word (same indexing as words), computed when not given
     """
-    minpenalty = [float('inf')]*(n+1)
-    break_points = [None]*(n+1)
-
-    # initialize base case
-    minpenalty[0] = 0
-
-    def compute_line_cost(extra_space, j, n):
-        if extra_space < 0:
-            return float('inf')
-        elif j == n and extra_space >= 0:
-            return 0
-        else:
-            return extra_space**3
+    if widths is None:
+        widths = [0] + [display_width(w) for w in words[1:n+1]]
+    minpenalty = [0]*(n+1)
+    break_points = [0]*(n+1)
 
     for j in range(1, n+1):
+        best = None
+        best_i = j
         extra_space = M + 1
-        for i in range(j, int(max(1, j + 1 - math.ceil(M/2)))-1, -1):
-            extra_space = extra_space - len(words[i]) - 1
-            cur_penalty = minpenalty[i-1] + compute_line_cost(extra_space, j, n)
-            if minpenalty[j] > cur_penalty:
-                minpenalty[j] = cur_penalty
-                break_points[j] = i
+        # move the beginning of the last line backwards until it overflows, the cost of a line
+        # is the cube of its extra space, and the last line is free
+        for i in range(j, 0, -1):
+            extra_space -= widths[i] + 1
+            if extra_space < 0:
+                break
+            cur_penalty = minpenalty[i-1] + (0 if j == n else extra_space*extra_space*extra_space)
+            if best is None or cur_penalty < best:
+                best = cur_penalty
+                best_i = i
+        if best is None:  # the word is longer than a line, leave it alone on its line
+            best = minpenalty[j-1]
+        minpenalty[j] = best
+        break_points[j] = best_i
 
     return minpenalty, break_points
 
 
 def reconstruct_lines(text, j, break_points):
-    i = break_points[j]
     neat_text = []
-    if i != 1:
-        neat_text = reconstruct_lines(text, i-1, break_points)
-    neat_text.append(' '.join(text[i:(j+1)]))
+    while j > 0:
+        i = break_points[j]
+        neat_text.append(' '.join(text[i:(j+1)]))
+        j = i - 1
+    neat_text.reverse()
     return neat_text
 
 
 def print_neatly(text, M):
-    n = len(text.split(' '))
-    text = ['BLANK'] + text.split(' ')
+    words = text.split(' ')
+    n = len(words)
+    text = ['BLANK'] + words
     min_p, p_list = print_neatly_optimizer(text, n, M)
     neat_text = reconstruct_lines(text, n, p_list)
     return neat_text
 
 
+def print_neatly_batch(texts, M):
+    """
+    Reflow many texts at once, identical texts and words are measured and reflowed only once
+    @return : list of reflowed texts (each one a list of lines), in the same order as texts
+    """
+    widths = {}
+    reflowed = {}
+    for text in texts:
+        if text in reflowed:
+            continue
+        words = ['BLANK'] + text.split(' ')
+        for w in words:
+            if w not in widths:
+                widths[w] = display_width(w)
+        n = len(words) - 1
+        min_p, p_list = print_neatly_optimizer(words, n, M, [widths[w] for w in words])
+        reflowed[text] = reconstruct_lines(words, n, p_list)
+    return [list(reflowed[text]) for text in texts]
+
+
 # adapted from: https://github.com/samuelklam/print-neatly/blob/master/print-neatly.py
 if __name__ == '__main__':
     text = "Buffy the Vampire Slayer fans are sure to get their fix with the DVD release of the show's first season. The three-disc collection includes all 12 episodes as well as many extras. There is a collection of interviews by the show's creator Joss Whedon in which he explains his inspiration for the show as well as comments on the various cast members. Much of the same material is covered in more depth with Whedon's commentary track for the show's first two episodes that make up the Buffy the Vampire Slayer pilot. The most interesting points of Whedon's commentary come from his explanation of the learning curve he encountered shifting from blockbuster films like Toy Story to a much lower-budget television series. The first disc also includes a short interview with David Boreanaz who plays the role of Angel. Other features include the script for the pilot episodes, a trailer, a large photo gallery of publicity shots and in-depth biographies of Whedon and several of the show's stars, including Sarah Michelle Gellar, Alyson Hannigan and Nicholas Brendon."
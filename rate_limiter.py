@@ -0,0 +1,206 @@
+import collections
+import random
+import re
+import threading
+import time
+
+# HTTP statuses returned by a provider that is rejecting requests because of their rate
+THROTTLING_STATUS = {408, 429, 500, 502, 503, 504}
+STATUS_IN_MESSAGE = re.compile(r'status code\D{0,3}(\d{3})')
+
+
+def is_throttling(error):
+    """
+    Tell whether a failed request was rejected by the provider (HTTP 429/5xx, connection errors, timeouts)
+    rather than failing because of the text being translated
+    """
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    status = getattr(error, 'status_code', None)
+    if status is None:
+        status = getattr(getattr(error, 'response', None), 'status_code', None)
+    if status is None:
+        match = STATUS_IN_MESSAGE.search(str(error))
+        status = int(match.group(1)) if match else None
+    if status is not None:
+        return status in THROTTLING_STATUS or status >= 500
+    # httpx (used by googletrans) does not derive its network errors from the builtin ones
+    name = type(error).__name__
+    return 'Timeout' in name or name in ('ConnectError', 'NetworkError', 'ReadError', 'WriteError', 'RemoteProtocolError')
+
+
+def backoff_delay(attempt, base=1.0, cap=30.0):
+    """
+    Jittered exponential backoff: a random delay between 0 and base * 2^attempt seconds, at most cap
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class AdaptiveTokenBucket:
+    """
+    Token bucket whose rate follows the success rate of the last requests: while the provider accepts them it grows
+    every second by `increase` requests per second or by a tenth, whichever is larger, and it halves when less than
+    min_success of the last `window` requests succeeded. Occasional failures do not lower it.
+    @param rate : initial number of requests per second
+    @param min_rate : minimum rate
+    @param max_rate : maximum rate
+    @param increase : requests per second added for each second of successful requests
+    @param window : number of recent requests the success rate is computed on
+    @param min_success : success rate under which the provider is considered to be throttling
+    """
+
+    def __init__(self, rate, min_rate=0.1, max_rate=100.0, increase=1.0, window=20, min_success=0.5):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.min_success = min_success
+        self._outcomes = collections.deque(maxlen=window)
+        self._tokens = 1.0
+        self._last = time.monotonic()
+        self._last_increase = self._last
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(max(1.0, self.rate), self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def on_success(self):
+        with self._lock:
+            self._outcomes.append(True)
+            now = time.monotonic()
+            # idle periods do not count, the rate only grows while requests are being accepted
+            step = max(self.increase, self.rate / 10)
+            self.rate = min(self.max_rate, self.rate + step * min(1.0, now - self._last_increase))
+            self._last_increase = now
+
+    def on_throttled(self):
+        with self._lock:
+            self._outcomes.append(False)
+            if len(self._outcomes) < self._outcomes.maxlen:
+                return
+            if sum(self._outcomes) / len(self._outcomes) < self.min_success:
+                self.rate = max(self.min_rate, self.rate / 2)
+                # the requests already in flight must not halve it again
+                self._outcomes.clear()
+                self._last_increase = time.monotonic()
+
+
+class CircuitBreaker:
+    """
+    Stops all the workers for cooldown seconds after failure_threshold consecutive throttled requests,
+    so a provider that started rejecting requests is not hammered
+    """
+
+    def __init__(self, failure_threshold=10, cooldown=30.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.trips = 0
+        self._failures = 0
+        self._open_until = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        while True:
+            with self._lock:
+                wait = self._open_until - time.monotonic()
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    def on_success(self):
+        with self._lock:
+            self._failures = 0
+
+    def on_throttled(self):
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.failure_threshold and self._open_until <= time.monotonic():
+                self._open_until = time.monotonic() + self.cooldown
+                self._failures = 0
+                self.trips += 1
+                print('the provider is rejecting the requests, pausing for {} seconds'.format(self.cooldown))
+
+
+class RateController:
+    """
+    Shared by all the workers of a run: waits for the circuit breaker and for the token bucket before each request
+    and adapts them to the outcome of the request
+    @param rate : initial requests per second, 0 to never throttle
+    @param backoff_base : base of the exponential backoff between retries of a request, in seconds
+    @param failure_threshold : consecutive throttled requests that open the circuit breaker, 0 to disable it
+    @param cooldown : seconds the circuit breaker stays open
+    """
+
+    def __init__(self, rate=0.0, backoff_base=1.0, failure_threshold=10, cooldown=30.0):
+        self.bucket = AdaptiveTokenBucket(rate, max_rate=max(100.0, rate)) if rate > 0 else None
+        self.breaker = CircuitBreaker(failure_threshold, cooldown) if failure_threshold > 0 else None
+        self.backoff_base = backoff_base
+        self.successes = 0
+        self.throttled = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def before_request(self):
+        if self.breaker is not None:
+            self.breaker.wait()
+        if self.bucket is not None:
+            self.bucket.acquire()
+
+    def on_success(self):
+        with self._lock:
+            self.successes += 1
+        if self.breaker is not None:
+            self.breaker.on_success()
+        if self.bucket is not None:
+            self.bucket.on_success()
+
+    def on_failure(self, error):
+        """
+        @return : True if the request was throttled and is worth retrying, False if it failed because of its text
+        """
+        if not is_throttling(error):
+            with self._lock:
+                self.errors += 1
+            return False
+        with self._lock:
+            self.throttled += 1
+        if self.breaker is not None:
+            self.breaker.on_throttled()
+        if self.bucket is not None:
+            self.bucket.on_throttled()
+        return True
+
+    def backoff(self, attempt):
+        time.sleep(backoff_delay(attempt, self.backoff_base))
+
+    def to_dict(self):
+        return {'successes': self.successes, 'throttled': self.throttled, 'errors': self.errors,
+                'circuit_breaker_trips': self.breaker.trips if self.breaker is not None else None,
+                'rate': round(self.bucket.rate, 2) if self.bucket is not None else None}
+
+    def __str__(self):
+        return 'rate control: {} requests succeeded, {} throttled, {} failed{}{}'.format(
+            self.successes, self.throttled, self.errors,
+            ', circuit breaker opened {} times'.format(self.breaker.trips) if self.breaker is not None else '',
+            ', final rate {:.1f}/s'.format(self.bucket.rate) if self.bucket is not None else '')
+
+
+def add_rate_arguments(ap):
+    ap.add_argument("-rt", "--rate", type=float, default=0.0)
+    ap.add_argument("-bb", "--backoff_base", type=float, default=1.0)
+    ap.add_argument("-ft", "--failure_threshold", type=int, default=10)
+    ap.add_argument("-cd", "--cooldown", type=float, default=30.0)
+    ap.add_argument("-rr", "--retry_rounds", type=int, default=2)
+
+
+def rate_controller_from_args(args):
+    return RateController(args.rate, args.backoff_base, args.failure_threshold, args.cooldown)
@@ -0,0 +1,191 @@
+import bisect
+import sys
+from array import array
+
+from journal import source_hash
+
+# bits of the event id, page, list and sub indexes in the packed key of a segment
+EVENT_BITS = 19
+PAGE_BITS = 12
+INDEX_BITS = 24
+SUB_BITS = 8
+
+
+class StringTable:
+    """
+    Strings stored once and identified by their position, shared by a whole project so that a text or a translation
+    repeated in many files costs a single string
+    @param strings : initial strings, they must be distinct (ex: a table saved with list(table))
+    """
+    __slots__ = ('_ids', '_strings')
+
+    def __init__(self, strings=()):
+        self._ids = {}
+        self._strings = []
+        for string in strings:
+            self.id(string)
+
+    def id(self, string):
+        """
+        @return : id of string, added to the table if missing
+        """
+        i = self._ids.get(string)
+        if i is None:
+            i = len(self._strings)
+            string = sys.intern(string)
+            self._ids[string] = i
+            self._strings.append(string)
+        return i
+
+    def find(self, string):
+        """
+        @return : id of string, or None if it is not in the table
+        """
+        return self._ids.get(string)
+
+    def __getitem__(self, i):
+        return self._strings[i]
+
+    def __len__(self):
+        return len(self._strings)
+
+    def __iter__(self):
+        return iter(self._strings)
+
+
+def pack_key(event, page, index, sub):
+    """
+    @return : single integer identifying the segment (event id, page index, list index, sub index) of a file
+    """
+    if not (0 <= event < 1 << EVENT_BITS and 0 <= page < 1 << PAGE_BITS and 0 <= index < 1 << INDEX_BITS and
+            0 <= sub < 1 << SUB_BITS):
+        raise ValueError('segment out of range: {}'.format((event, page, index, sub)))
+    return (((event << PAGE_BITS | page) << INDEX_BITS | index) << SUB_BITS) | sub
+
+
+def unpack_key(key):
+    """
+    @return : (event id, page index, list index, sub index) packed in key by pack_key
+    """
+    sub = key & ((1 << SUB_BITS) - 1)
+    key >>= SUB_BITS
+    index = key & ((1 << INDEX_BITS) - 1)
+    key >>= INDEX_BITS
+    return key >> PAGE_BITS, key & ((1 << PAGE_BITS) - 1), index, sub
+
+
+def text_hash(text):
+    """
+    @return : 64 bits hash of text, stable across runs (unlike hash)
+    """
+    return int(source_hash(text), 16)
+
+
+class SegmentStore:
+    """
+    Segments of a file as parallel arrays of integers instead of dicts, lists and tuples: each record is a segment
+    (event id, page index, list index, sub index) with its code, the hash of its source text and the strings written
+    for it, the code and the strings being ids of a StringTable shared by all the files
+    @param strings : StringTable of the codes and the outputs
+    """
+    __slots__ = ('strings', 'key', 'code', 'source', 'output_end', 'outputs', '_index')
+
+    def __init__(self, strings):
+        self.strings = strings
+        # packed (event id, page index, list index, sub index)
+        self.key = array('q')
+        # id of the code (ex: '401') in strings, -1 when unknown
+        self.code = array('l')
+        # text_hash of the source text
+        self.source = array('Q')
+        # outputs of record r are outputs[output_end[r - 1]:output_end[r]]
+        self.output_end = array('l')
+        self.outputs = array('l')
+        # (sorted keys, their records), built on the first lookup after an add
+        self._index = None
+
+    def add(self, event, page, index, sub, source, outputs, code=None):
+        """
+        Add a segment, it replaces the segment of the file with the same key if any
+        @return : the record of the segment
+        """
+        self.key.append(pack_key(event, page, index, sub))
+        self.code.append(-1 if code is None else self.strings.id(str(code)))
+        self.source.append(text_hash(source))
+        self.outputs.extend(self.strings.id(output) for output in outputs)
+        self.output_end.append(len(self.outputs))
+        self._index = None
+        return len(self.key) - 1
+
+    def _records(self):
+        """
+        @return : records that were not replaced, sorted by key
+        """
+        if self._index is None:
+            # the last record added with a key replaces the previous ones
+            last = {}
+            for r, key in enumerate(self.key):
+                last[key] = r
+            keys = sorted(last)
+            self._index = (array('q', keys), array('l', (last[key] for key in keys)))
+        return self._index
+
+    def find(self, event, page, index, sub):
+        """
+        @return : record of the segment, or None if the file has no such segment
+        """
+        keys, records = self._records()
+        key = pack_key(event, page, index, sub)
+        i = bisect.bisect_left(keys, key)
+        return records[i] if i < len(keys) and keys[i] == key else None
+
+    def matches(self, r, text):
+        """
+        @return : True if text is the source text of record r
+        """
+        return self.source[r] == text_hash(text)
+
+    def code_of(self, r):
+        return None if self.code[r] < 0 else self.strings[self.code[r]]
+
+    def outputs_of(self, r):
+        start = self.output_end[r - 1] if r > 0 else 0
+        return [self.strings[i] for i in self.outputs[start:self.output_end[r]]]
+
+    def __len__(self):
+        return len(self._records()[1])
+
+    def to_dict(self, table):
+        """
+        @param table : StringTable of the saved file, the ids of the strings are translated to it
+        @return : JSON serializable content of the store
+        """
+        keys, records = self._records()
+        segments = [unpack_key(key) for key in keys]
+        return {
+            'event': [segment[0] for segment in segments],
+            'page': [segment[1] for segment in segments],
+            'index': [segment[2] for segment in segments],
+            'sub': [segment[3] for segment in segments],
+            'code': [table.id(self.code_of(r)) if self.code[r] >= 0 else -1 for r in records],
+            'source': ['{:016x}'.format(self.source[r]) for r in records],
+            'outputs': [[table.id(output) for output in self.outputs_of(r)] for r in records],
+        }
+
+    @classmethod
+    def from_dict(cls, content, saved_strings, strings):
+        """
+        @param content : dict returned by to_dict
+        @param saved_strings : list of the strings of the saved file
+        @param strings : StringTable of the new store
+        """
+        store = cls(strings)
+        for event, page, index, sub, code, source, outputs in zip(
+                content['event'], content['page'], content['index'], content['sub'], content['code'],
+                content['source'], content['outputs']):
+            store.key.append(pack_key(event, page, index, sub))
+            store.code.append(-1 if code < 0 else strings.id(saved_strings[code]))
+            store.source.append(int(source, 16))
+            store.outputs.extend(strings.id(saved_strings[i]) for i in outputs)
+            store.output_end.append(len(store.outputs))
+        return store
@@ -0,0 +1,74 @@
+import json
+import re
+
+# a JSON string literal, followed by a colon when it is the key of an object
+STRING_LITERAL = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"(\s*:)?')
+
+
+class SpanDocument:
+    """
+    Content of a JSON file remembering where each string value is in the file, so that a copy of the file can be
+    written replacing only the strings changed since it was loaded: the formatting of the original file is kept,
+    writing is much faster than json.dump with indent and the diff with the original file is minimal.
+    @param file_path : JSON file to load
+    @attr data : content of the file, as returned by json.load
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        with open(file_path, 'r', encoding='utf-8') as f:
+            text = f.read()
+        # offsets are counted on the text of the file as it is, byte order mark included
+        self.data = json.loads(text[1:] if text.startswith('\ufeff') else text)
+        spans = (match.span() for match in STRING_LITERAL.finditer(text) if match.lastindex is None)
+        # (container, key, value read, start, end) of each string value, in the order of the file
+        self._strings = []
+
+        def walk(container, items):
+            for key, value in items:
+                if type(value) is str:
+                    self._strings.append((container, key, value) + next(spans))
+                elif type(value) is dict:
+                    walk(value, value.items())
+                elif type(value) is list:
+                    walk(value, enumerate(value))
+
+        try:
+            if type(self.data) is dict:
+                walk(self.data, self.data.items())
+            elif type(self.data) is list:
+                walk(self.data, enumerate(self.data))
+            exhausted = next(spans, None) is None
+        except StopIteration:
+            exhausted = False
+        if not exhausted:
+            raise ValueError('{}: the strings of the file do not match its content (duplicated keys?)'.format(
+                file_path))
+
+    def changes(self):
+        """
+        @return : list of (start, end, literal) of the strings changed since the file was loaded, in the order of
+                  the file, where literal is the new JSON string
+        """
+        return [(start, end, json.dumps(container[key], ensure_ascii=False))
+                for container, key, value, start, end in self._strings
+                if container[key] is not value and container[key] != value]
+
+    def save(self, new_file):
+        """
+        Write to new_file a copy of the original file where only the changed strings are replaced
+        @return : number of strings replaced
+        """
+        with open(self.file_path, 'r', encoding='utf-8') as f:
+            text = f.read()
+        changes = self.changes()
+        pieces = []
+        last = 0
+        for start, end, literal in changes:
+            pieces.append(text[last:start])
+            pieces.append(literal)
+            last = end
+        pieces.append(text[last:])
+        with open(new_file, 'w', encoding='utf-8') as f:
+            f.write(''.join(pieces))
+        return len(changes)
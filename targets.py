@@ -0,0 +1,38 @@
+import os
+
+
+def parse_targets(dest_lang, max_len):
+    """
+    @param dest_lang : destination language, or comma separated destination languages (ex: 'en,fr,de')
+    @param max_len : length of the dialog window, or comma separated lengths by language (ex: 'en:44,fr:48'),
+                     a length without language is the one of the languages not listed (ex: '44,de:50')
+    @return : dict of the max_len of each destination language, in the order of dest_lang
+    """
+    langs = [lang.strip() for lang in dest_lang.split(',') if lang.strip()]
+    if not langs or len(set(langs)) != len(langs):
+        raise ValueError('invalid destination languages: {}'.format(dest_lang))
+    default = None
+    lengths = {}
+    for item in str(max_len).split(','):
+        lang, _, length = item.strip().rpartition(':')
+        if not lang:
+            default = int(length)
+        elif lang in langs:
+            lengths[lang] = int(length)
+        else:
+            raise ValueError('max_len given for {} which is not a destination language'.format(lang))
+    missing = [lang for lang in langs if lang not in lengths]
+    if missing and default is None:
+        raise ValueError('no max_len for {}'.format(', '.join(missing)))
+    return {lang: lengths.get(lang, default) for lang in langs}
+
+
+def target_path(path, lang, several):
+    """
+    @return : path of the file of lang (ex: journal.jsonl -> journal_fr.jsonl) when there are several destination
+              languages, path itself otherwise
+    """
+    if not several:
+        return path
+    root, ext = os.path.splitext(path)
+    return '{}_{}{}'.format(root, lang, ext)
@@ -0,0 +1,55 @@
+import os
+import tempfile
+import unittest
+
+from backends import OfflineBackend
+from translation_cache import TranslationCache
+from translation_engine import TranslationEngine
+
+
+class PackingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.cache = TranslationCache(os.path.join(self.dir.name, 'cache.db'))
+
+    def tearDown(self):
+        self.cache.close()
+        self.dir.cleanup()
+
+    def engine(self):
+        # the packs are sent joined by the delimiter, each word is reversed
+        return TranslationEngine(OfflineBackend('reverse', max_batch=1), cache=self.cache, pack_chars=100,
+                                 retry_rounds=0, mask=False)
+
+    def test_packs_keep_order(self):
+        self.cache.put('ciao mondo', 'it', 'en', 'hello world')
+        packs = self.engine().make_packs(['uno', 'due', 'ciao mondo', 'tre', 'x' * 100, 'cinque', 'sei'])
+        self.assertEqual(packs, [['uno', 'due'], ['ciao mondo'], ['tre'], ['x' * 100], ['cinque', 'sei']])
+
+    def test_cached_sentence_in_packs(self):
+        self.cache.put('ciao mondo', 'it', 'en', 'hello world')
+        texts = ['uno due', 'ciao mondo', 'tre quattro']
+        expected = [('onu eud', True), ('hello world', True), ('ert orttauq', True)]
+        self.assertEqual(self.engine().translate_unique(texts, lambda text, translation: None),
+                         dict(zip(texts, expected)))
+
+    def test_oversized_sentence_in_packs(self):
+        long_text = ' '.join(['parola'] * 20)
+        texts = ['uno due', long_text, 'tre quattro']
+        expected = [('onu eud', True), (' '.join(['alorap'] * 20), True), ('ert orttauq', True)]
+        self.assertEqual(self.engine().translate_unique(texts, lambda text, translation: None),
+                         dict(zip(texts, expected)))
+
+
+class FailureTest(unittest.TestCase):
+
+    def test_failed_sentences_keep_their_text(self):
+        texts = ['uno \\C[1]due', 'tre']
+        for mask in (True, False):
+            engine = TranslationEngine(OfflineBackend(failure_rate=1.0), max_retries=0, retry_rounds=0, mask=mask)
+            self.assertEqual(engine.translate_all(texts), [(text, False) for text in texts])
+
+
+if __name__ == '__main__':
+    unittest.main()
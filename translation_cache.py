@@ -0,0 +1,99 @@
+import re
+import sqlite3
+import threading
+
+
+def normalize_text(text):
+    """
+    Normalize a sentence before using it as cache key
+    @param text : sentence to normalize
+    """
+    return re.sub(' +', ' ', text.strip())
+
+
+class TranslationCache:
+    """
+    Persistent translation memory stored in a SQLite database
+    @param path : path of the database file (created if missing)
+    @param max_entries : maximum number of cached translations, least recently used ones are evicted first
+    @param commit_every : number of writes buffered before committing to disk
+    """
+
+    def __init__(self, path, max_entries=100000, commit_every=100):
+        self.path = path
+        self.max_entries = max_entries
+        self.commit_every = commit_every
+        self.hits = 0
+        self.misses = 0
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS translations ('
+                         'src TEXT NOT NULL, dst TEXT NOT NULL, text TEXT NOT NULL, translation TEXT NOT NULL, '
+                         'last_used INTEGER NOT NULL, PRIMARY KEY (src, dst, text))')
+        self._db.execute('CREATE INDEX IF NOT EXISTS translations_last_used ON translations (last_used)')
+        self._db.commit()
+        self._size, last_used = self._db.execute('SELECT COUNT(*), MAX(last_used) FROM translations').fetchone()
+        self._clock = last_used or 0
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, key):
+        text, src, dst = key
+        with self._lock:
+            row = self._db.execute('SELECT 1 FROM translations WHERE src=? AND dst=? AND text=?',
+                                   (src, dst, normalize_text(text))).fetchone()
+        return row is not None
+
+    def get(self, text, src, dst):
+        """
+        Return the cached translation of text or None if it has never been translated
+        """
+        key = normalize_text(text)
+        with self._lock:
+            row = self._db.execute('SELECT translation FROM translations WHERE src=? AND dst=? AND text=?',
+                                   (src, dst, key)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._clock += 1
+            self._db.execute('UPDATE translations SET last_used=? WHERE src=? AND dst=? AND text=?',
+                             (self._clock, src, dst, key))
+            self._written()
+            return row[0]
+
+    def put(self, text, src, dst, translation):
+        key = normalize_text(text)
+        with self._lock:
+            self._clock += 1
+            cur = self._db.execute('UPDATE translations SET translation=?, last_used=? WHERE src=? AND dst=? AND text=?',
+                                   (translation, self._clock, src, dst, key))
+            if cur.rowcount == 0:
+                self._db.execute('INSERT INTO translations VALUES (?, ?, ?, ?, ?)',
+                                 (src, dst, key, translation, self._clock))
+                self._size += 1
+                if self._size > self.max_entries:
+                    self._evict(self._size - self.max_entries)
+            self._written()
+
+    def _evict(self, n):
+        self._db.execute('DELETE FROM translations WHERE rowid IN '
+                         '(SELECT rowid FROM translations ORDER BY last_used LIMIT ?)', (n,))
+        self._size -= n
+
+    def _written(self):
+        self._pending += 1
+        if self._pending >= self.commit_every:
+            self._db.commit()
+            self._pending = 0
+
+    def close(self):
+        with self._lock:
+            self._db.commit()
+            self._db.close()
+
+    def __str__(self):
+        return 'cache {}: {} hits, {} misses, {} entries'.format(self.path, self.hits, self.misses, self._size)
+
@@ -0,0 +1,242 @@
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from backends import as_backend
+from masking import mask_codes, unmask_codes
+from metrics import Metrics
+from rate_limiter import RateController
+
+# sentinel placed between the sentences of a pack, it must survive the translation unchanged
+PACK_DELIMITER = '\n¶\n'
+PACK_SPLIT = re.compile(r'\s*¶\s*')
+
+
+class TranslationEngine:
+    """
+    Translates batches of sentences running at most `workers` requests at the same time.
+    A single engine can be shared by several files being translated concurrently.
+    @param tr : TranslatorBackend, or any translator providing translate(text, src=src, dest=dst).text
+    @param src : source language
+    @param dst : destination language
+    @param max_retries : number of further attempts after a failed translation
+    @param cache : TranslationCache or None
+    @param workers : maximum number of requests in flight
+    @param pack_chars : if greater than 0, sentences are packed together in requests of at most pack_chars characters
+                        (never more than the limit declared by the backend)
+    @param rate_control : RateController shared by all the requests, by default one that never throttles
+    @param retry_rounds : number of times the sentences whose translation failed are sent again,
+                          after all the others have been translated
+    @param metrics : Metrics recording the requests of the engine, by default one that does not print the progress
+    @param mask : replace the control codes with placeholders before the translation and restore them after
+    @param slots : semaphore shared by engines whose requests in flight must not exceed `workers` all together
+                   (ex: the engines of several destination languages), by default the engine has its own
+    """
+
+    def __init__(self, tr, src='it', dst='en', max_retries=5, cache=None, workers=1, pack_chars=0, rate_control=None,
+                 retry_rounds=2, metrics=None, mask=True, slots=None):
+        self.tr = as_backend(tr)
+        self.src = src
+        self.dst = dst
+        self.max_retries = max_retries
+        self.cache = cache
+        self.workers = workers
+        self.pack_chars = min(pack_chars, self.tr.max_chars)
+        self.rate_control = rate_control if rate_control is not None else RateController()
+        self.retry_rounds = retry_rounds
+        self.metrics = metrics if metrics is not None else Metrics(progress_interval=0)
+        self.mask = mask
+        self.slots = slots if slots is not None else threading.Semaphore(workers)
+        self._pool = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+
+    @staticmethod
+    def fix_case(target, translation):
+        if target[0].isalpha() and translation[0].isalpha and not target[0].isupper():
+            translation = translation[0].lower() + translation[1:]
+        return translation
+
+    def request(self, function, *args):
+        """
+        Call function(*args) waiting for the rate control, and retry it with exponential backoff when the provider
+        throttles it. Other errors (ex: a string the translator cannot handle) fail at once.
+        @return : (result, True), or (None, False) when all the attempts failed
+        """
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                self.metrics.count('retries')
+                self.rate_control.backoff(attempt - 1)
+            with self.metrics.timer('rate_control_wait'):
+                self.rate_control.before_request()
+            self.slots.acquire()
+            start = time.perf_counter()
+            try:
+                result = function(*args)
+            except Exception as e:
+                self.metrics.observe('failed_request', time.perf_counter() - start)
+                if not self.rate_control.on_failure(e):
+                    return (None, False)
+                continue
+            finally:
+                self.slots.release()
+            self.metrics.observe('request', time.perf_counter() - start)
+            self.rate_control.on_success()
+            return (result, True)
+        return (None, False)
+
+    def try_translate_sentence(self, text):
+        if self.cache is not None:
+            translation = self.cache.get(text, self.src, self.dst)
+            if translation is not None:
+                self.metrics.count('cache_hits')
+                return (self.fix_case(text, translation), True)
+            self.metrics.count('cache_misses')
+        translation, success = self.request(self.tr.translate, text, self.src, self.dst)
+        # an empty translation is a failure, fix_case could not even look at its first character
+        if not success or not translation:
+            return (text, False)
+        if self.cache is not None:
+            self.cache.put(text, self.src, self.dst, translation)
+        return (self.fix_case(text, translation), True)
+
+    def translate_all(self, texts, keys=None, journal=None):
+        """
+        Translate a list of sentences
+        @param texts : sentences to translate, identical sentences are translated only once
+        @param keys : keys identifying each sentence in the journal
+        @param journal : TranslationJournal or None, sentences already in the journal are not translated again
+                         and new translations are added to it as soon as they are available
+        @return : list of (translation, success) in the same order as texts, the translation is the original
+                  sentence when success is False
+        """
+        replayed = [None] * len(texts)
+        keys_of = {}
+        if journal is not None:
+            replayed = [journal.get(key, text) for key, text in zip(keys, texts)]
+            for key, text, translation in zip(keys, texts, replayed):
+                if translation is None:
+                    keys_of.setdefault(text, []).append(key)
+        unique = list(dict.fromkeys(text for text, translation in zip(texts, replayed) if translation is None))
+        results = {}
+
+        def text_done(text, translation):
+            results[text] = (translation, True)
+            if journal is not None:
+                for key in keys_of[text]:
+                    journal.add(key, text, translation)
+
+        if self.mask:
+            # sentences differing only by their control codes are translated once as the same template
+            templates = {}
+            for text in unique:
+                template, codes = mask_codes(text)
+                templates.setdefault(template, []).append((text, codes))
+
+            def template_done(template, translation):
+                for text, codes in templates[template]:
+                    restored = unmask_codes(translation, codes)
+                    if restored is not None:
+                        text_done(text, restored)
+
+            for template, (_, success) in self.translate_unique(list(templates), template_done).items():
+                if not success:
+                    for text, _ in templates[template]:
+                        results[text] = (text, False)
+            # the sentences whose placeholders did not survive the translation are translated as they are
+            unique = [text for text in unique if text not in results]
+        for text, (_, success) in self.translate_unique(unique, text_done).items():
+            if not success:
+                results[text] = (text, False)
+        return [results[text] if translation is None else (translation, True)
+                for text, translation in zip(texts, replayed)]
+
+    def translate_unique(self, texts, on_translated):
+        """
+        Translate distinct sentences, packed if pack_chars is set, sending again the failed ones for retry_rounds
+        @param on_translated : called with (text, translation) as soon as each sentence is translated
+        @return : dict of (translation, success) of each sentence
+        """
+        def translate_unit(pack):
+            pack_results = self.try_translate_pack(pack)
+            self.metrics.segments_done(sum(success for _, success in pack_results))
+            for text, (translation, success) in zip(pack, pack_results):
+                if success:
+                    on_translated(text, translation)
+            return list(zip(pack, pack_results))
+
+        results = {}
+        pending = texts
+        for retry in range(self.retry_rounds + 1):
+            if not pending:
+                break
+            if retry > 0:
+                print('retrying {} failed sentences'.format(len(pending)))
+            units = self.make_packs(pending) if self.pack_chars > 0 else [[text] for text in pending]
+            if self._pool is None:
+                translated = list(map(translate_unit, units))
+            else:
+                translated = list(self._pool.map(translate_unit, units))
+            # results are keyed by their sentence, the packs do not have to follow the order of pending
+            results.update(result for pack_results in translated for result in pack_results)
+            # failed sentences are queued for the next round instead of being dropped
+            pending = [text for text in pending if not results[text][1]]
+        return results
+
+    def make_packs(self, texts):
+        """
+        Group sentences in packs of at most pack_chars characters (delimiters included), keeping their order.
+        Sentences already cached, containing the delimiter or longer than pack_chars are left alone in their pack.
+        """
+        packs = []
+        pack = []
+        pack_len = 0
+        for text in texts:
+            if (len(text) >= self.pack_chars or '¶' in text or
+                    (self.cache is not None and (text, self.src, self.dst) in self.cache)):
+                # the open pack is closed first so the packs follow the order of texts
+                if pack:
+                    packs.append(pack)
+                    pack = []
+                    pack_len = 0
+                packs.append([text])
+                continue
+            if pack and pack_len + len(PACK_DELIMITER) + len(text) > self.pack_chars:
+                packs.append(pack)
+                pack = []
+                pack_len = 0
+            pack_len += len(text) + (len(PACK_DELIMITER) if pack else 0)
+            pack.append(text)
+        if pack:
+            packs.append(pack)
+        return packs
+
+    def translate_pack(self, pack):
+        if len(pack) <= self.tr.max_batch:
+            parts = self.tr.translate_batch(pack, self.src, self.dst)
+        else:
+            parts = PACK_SPLIT.split(self.tr.translate(PACK_DELIMITER.join(pack), self.src, self.dst).strip())
+        if len(parts) != len(pack) or not all(parts):
+            return None
+        return parts
+
+    def try_translate_pack(self, pack):
+        """
+        Translate a pack with a single request, if the delimiters do not survive the translation
+        each sentence of the pack is translated on its own
+        @return : list of (translation, success)
+        """
+        if len(pack) == 1:
+            return [self.try_translate_sentence(pack[0])]
+        parts, success = self.request(self.translate_pack, pack)
+        if not success:
+            return [(text, False) for text in pack]
+        if parts is None:
+            return [self.try_translate_sentence(text) for text in pack]
+        if self.cache is not None:
+            for text, part in zip(pack, parts):
+                self.cache.put(text, self.src, self.dst, part)
+        return [(self.fix_case(text, part), True) for text, part in zip(pack, parts)]
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()